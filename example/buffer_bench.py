@@ -0,0 +1,75 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+Throughput of large upserts and large search responses against a local stand-in
+server, with the kernel default socket buffers and with send_buf_size and
+recv_buf_size set. Loopback has no bandwidth-delay product to fill, so it only
+shows what undersized buffers cost; the gain of large buffers shows over high
+latency links, which can be emulated with e.g. `tc qdisc add dev lo root netem
+delay 20ms`.
+
+    python example/buffer_bench.py [rows per upsert] [dimension] [requests]
+"""
+
+import json
+import random
+import sys
+import time
+
+from stand_in_server import StandInServer
+
+from pymochow.model.table import AnnSearch, HNSWSearchParams, Row
+
+# (name, send_buf_size, recv_buf_size), 0 leaving the kernel defaults
+_BUFFERS = [
+    ('kernel defaults', 0, 0),
+    ('64KB', 64 * 1024, 64 * 1024),
+    ('1MB / 10MB', 1024 * 1024, 10 * 1024 * 1024),
+]
+
+
+def main(rows=1000, dimension=768, requests=20):
+    """run the benchmark"""
+    vector = [random.random() for _ in range(dimension)]
+    hits = json.dumps({'code': 0, 'msg': '', 'rows': [
+        {'row': {'id': i, 'vector': vector}, 'distance': 0.5} for i in range(rows)]}).encode()
+    written = json.dumps({'code': 0, 'msg': '', 'affectedCount': rows}).encode()
+
+    def handle(path, body):
+        return hits if 'search' in path else written
+
+    server = StandInServer(handle, parse=False)
+    batch = [Row(id=i, vector=vector) for i in range(rows)]
+    search = AnnSearch('vector', vector, HNSWSearchParams(ef=rows, limit=rows))
+    print('%d rows of %d floats per request, %d requests' % (rows, dimension, requests))
+    for name, send_buf_size, recv_buf_size in _BUFFERS:
+        client, table = server.table(send_buf_size=send_buf_size, recv_buf_size=recv_buf_size)
+        table.upsert(batch[:1])
+        server.reset()
+        began = time.monotonic()
+        for _ in range(requests):
+            table.upsert(batch)
+        upsert_elapsed = time.monotonic() - began
+        sent = server.bytes_received
+        began = time.monotonic()
+        for _ in range(requests):
+            table.search(search)
+        search_elapsed = time.monotonic() - began
+        client.close()
+        print('%-16s upsert %7.1f MB/s   search %6.1f responses/s'
+                % (name, sent / upsert_elapsed / 1e6, requests / search_elapsed))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
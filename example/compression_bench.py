@@ -0,0 +1,70 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+Client CPU cost against bytes saved of request body compression, upserting rows of
+float vectors to a local stand-in server which decodes and counts the bodies. Only
+the CPU time of the calling thread is counted. zstd is skipped when the zstandard
+package is missing.
+
+    python example/compression_bench.py [rows per upsert] [dimension] [requests]
+"""
+
+import importlib.util
+import random
+import sys
+import time
+
+from stand_in_server import StandInServer
+
+from pymochow.model.table import Row
+
+_WRITTEN = b'{"code": 0, "msg": ""}'
+
+
+def main(rows=1000, dimension=768, requests=10):
+    """run the benchmark"""
+    server = StandInServer(lambda path, body: _WRITTEN, parse=False)
+    batch = [Row(id=i, vector=[random.random() for _ in range(dimension)])
+            for i in range(rows)]
+    compressions = [None, 'gzip']
+    if importlib.util.find_spec('zstandard') is not None:
+        compressions.append('zstd')
+    else:
+        print('zstandard is not installed, skipping zstd')
+    print('%d rows of %d floats per upsert, %d upserts' % (rows, dimension, requests))
+    for compression in compressions:
+        client, table = server.table(compression=compression)
+        server.reset()
+        began = time.thread_time()
+        wall = time.monotonic()
+        for _ in range(requests):
+            table.upsert(batch)
+        cpu = (time.thread_time() - began) / requests * 1e3
+        wall = (time.monotonic() - wall) / requests * 1e3
+        client.close()
+        sent = server.bytes_received / requests / 1e6
+        saved = 1 - server.bytes_received / server.bytes_decoded
+        line = ('%-5s %6.2f MB sent (%4.1f%% saved)  %7.1f ms CPU  %7.1f ms wall per upsert'
+                % (compression or 'none', sent, saved * 100, cpu, wall))
+        if compression is None:
+            baseline = (sent, cpu)
+        elif cpu > baseline[1]:
+            # below this bandwidth the time saved sending exceeds the CPU spent
+            line += ', pays off below %.0f Mbit/s' % (
+                    (baseline[0] - sent) * 8 / ((cpu - baseline[1]) / 1e3))
+        print(line)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
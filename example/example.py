@@ -25,7 +25,7 @@ from pymochow.auth.bce_credentials import BceCredentials
 from pymochow.exception import ClientError, ServerError
 from pymochow.model.schema import Schema, Field, SecondaryIndex, VectorIndex, HNSWParams, PUCKParams, AutoBuildTiming, AutoBuildPeriodical, AutoBuildRowCountIncrement
 from pymochow.model.enum import FieldType, IndexType, MetricType, ServerErrCode
-from pymochow.model.enum import TableState, IndexState
+from pymochow.model.enum import TableState
 from pymochow.model.table import Partition, Row, AnnSearch, HNSWSearchParams, PUCKSearchParams
 
 
@@ -199,11 +199,7 @@ class TestMochow:
         table = db.table('book_segments')
         
         table.rebuild_index("vector_idx")
-        while True:
-            time.sleep(2)
-            index = table.describe_index("vector_idx")
-            if index.state == IndexState.NORMAL:
-                break
+        table.wait_for_index("vector_idx")
 
         # single search
         if self._index_type == IndexType.HNSW:
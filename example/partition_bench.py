@@ -0,0 +1,74 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+Write throughput of BulkWriter with and without partition grouping against a
+local stand-in server which charges every batch a fixed cost per partition it
+touches, as a server forwarding each partition's rows to its own shard does.
+The cost model is an assumption of the stand-in; the partitions touched per
+batch are what grouping changes, whatever the server.
+
+    python example/partition_bench.py [rows] [partitions] [ms per partition]
+"""
+
+import sys
+import time
+
+from stand_in_server import StandInServer
+
+from pymochow.bulk.writer import BulkWriter
+from pymochow.model.database import Database
+from pymochow.model.enum import FieldType
+from pymochow.model.schema import Field, Schema
+from pymochow.model.table import Partition, Row, Table
+
+
+def _partition_hash(value):
+    """the partition function assumed of the stand-in server"""
+    return value * 2654435761 % 2 ** 32
+
+
+def main(rows=20000, partitions=16, ms_per_partition=2):
+    """run the benchmark"""
+    touched = []
+
+    def handle(path, body):
+        keys = {_partition_hash(row['id']) % partitions for row in body.get('rows', [])}
+        touched.append(len(keys))
+        time.sleep(len(keys) * ms_per_partition / 1000.0)
+        return {'code': 0, 'msg': '', 'affectedCount': len(body.get('rows', []))}
+
+    server = StandInServer(handle)
+    client, _ = server.table()
+    schema = Schema([Field('id', FieldType.UINT64, primary_key=True, partition_key=True)])
+    table = Table(Database(client._conn, 'db', client._config), 'table', 1,
+            Partition(partitions), schema, config=client._config)
+    data = [Row(id=i) for i in range(rows)]
+    print('%d rows, %d partitions, %d ms per partition touched, batches of 500'
+            % (rows, partitions, ms_per_partition))
+    for name, options in [
+            ('not grouped', {'group_by_partition': False}),
+            ('grouped by key', {}),
+            ('grouped by partition', {'partition_hash': _partition_hash})]:
+        writer = BulkWriter(table, batch_size=500, concurrency=4, **options)
+        del touched[:]
+        began = time.monotonic()
+        result = writer.write(data)
+        elapsed = time.monotonic() - began
+        print('%-21s %8.0f rows/s  %5.1f partitions per batch  %d failed'
+                % (name, rows / elapsed, sum(touched) / len(touched), len(result.failures)))
+    client.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
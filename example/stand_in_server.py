@@ -0,0 +1,109 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+A local stand-in for a Mochow server, used by the benchmark examples. It decodes
+compressed request bodies, counts the requests and bytes it receives and answers
+row and search requests through a handle function, without storing anything.
+"""
+
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pymochow
+from pymochow.auth.bce_credentials import BceCredentials
+from pymochow.configuration import Configuration
+from pymochow.model.database import Database
+from pymochow.model.table import Table
+
+
+def default_handle(path, body):
+    """answer writes with the number of rows and other requests with success"""
+    response = {'code': 0, 'msg': ''}
+    if 'rows' in body:
+        response['affectedCount'] = len(body['rows'])
+    return response
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Args:
+        handle(Callable[[str, dict], Union[dict, bytes]]): the response of a
+            request, from its path and decoded body, bytes being sent as is
+        parse(bool): pass the body to handle as parsed json, or as bytes to
+            keep the server cheap in throughput benchmarks
+    """
+    daemon_threads = True
+
+    def __init__(self, handle=default_handle, parse=True):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.handle = handle
+        self.parse = parse
+        self.lock = threading.Lock()
+        self.requests = 0
+        # bytes of request bodies as sent, and once decoded
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def endpoint(self):
+        """endpoint of the server"""
+        return 'http://127.0.0.1:%d' % self.server_port
+
+    def reset(self):
+        """reset the counters"""
+        with self.lock:
+            self.requests = 0
+            self.bytes_received = 0
+            self.bytes_decoded = 0
+
+    def table(self, **config):
+        """a table of a new client of the server, the config overriding the defaults"""
+        client = pymochow.MochowClient(Configuration(credentials=BceCredentials('root', 'key'),
+            endpoint=self.endpoint, **config))
+        database = Database(client._conn, 'db', client._config)
+        return client, Table(database, 'table', 1, None, None, config=client._config)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        size = len(data)
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            data = gzip.decompress(data)
+        elif encoding == 'zstd':
+            import zstandard
+            data = zstandard.ZstdDecompressor().decompress(data)
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes_received += size
+            self.server.bytes_decoded += len(data)
+        response = self.server.handle(self.path,
+                json.loads(data or b'{}') if self.server.parse else data)
+        if not isinstance(response, bytes):
+            response = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_DELETE = do_POST
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,77 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+Client CPU time per small request against a local stand-in server, with the
+prepared request template of the endpoint reused, and rebuilt on every request
+as the headers, endpoint and signature were before templates. Only the CPU time
+of the calling thread is counted, so the server does not blur the result. The
+template work is also timed alone, as the rest of a request, mostly in requests
+and urllib3, can hide it.
+
+    python example/template_bench.py [requests]
+"""
+
+import sys
+import time
+
+from stand_in_server import StandInServer
+
+from pymochow.auth import bce_v1_signer
+from pymochow.model.table import Row
+
+_WRITTEN = b'{"code": 0, "msg": "", "affectedCount": 1}'
+
+
+def _cpu_per_request(table, requests, rebuild):
+    """microseconds of CPU of the calling thread per upsert"""
+    templates = table.conn._request_templates
+    row = [Row(id=1)]
+    began = time.thread_time()
+    for _ in range(requests):
+        if rebuild:
+            templates.clear()
+        table.upsert(row)
+    return (time.thread_time() - began) / requests * 1e6
+
+
+def _cpu_per_template(table, requests, rebuild):
+    """microseconds of CPU of the calling thread per template lookup"""
+    conn = table.conn
+    config = table._config
+    templates = conn._request_templates
+    sign_function = bce_v1_signer.sign
+    began = time.thread_time()
+    for _ in range(requests):
+        if rebuild:
+            templates.clear()
+        conn._get_request_template(config, sign_function)
+    return (time.thread_time() - began) / requests * 1e6
+
+
+def main(requests=5000):
+    """run the benchmark"""
+    server = StandInServer(lambda path, body: _WRITTEN, parse=False)
+    client, table = server.table()
+    table.upsert([Row(id=0)])
+    print('%d upserts of one row' % requests)
+    for rebuild in (True, False):
+        cpu = _cpu_per_request(table, requests, rebuild)
+        template_cpu = _cpu_per_template(table, requests, rebuild)
+        print('%-20s %7.1f us CPU per request, %6.1f us of it for the template'
+                % ('rebuilt per request' if rebuild else 'template reused', cpu, template_cpu))
+    client.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,105 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+Stress check of one MochowClient shared by many threads, against a local stand-in
+server echoing what each request asked for, so that a response delivered to the
+wrong thread or a corrupted request is detected.
+
+    python example/thread_stress.py [threads] [requests per thread]
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pymochow
+from pymochow.auth.bce_credentials import BceCredentials
+from pymochow.configuration import Configuration
+from pymochow.model.database import Database
+from pymochow.model.table import AnnSearch, HNSWSearchParams, Row, Table
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """answer upsert with the number of rows and search with the query vector"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        response = {'code': 0, 'msg': ''}
+        if 'upsert' in self.path:
+            response['affectedCount'] = len(body['rows'])
+            response['ids'] = [row['id'] for row in body['rows']]
+        elif 'search' in self.path:
+            response['rows'] = [{'row': {'id': body['anns']['vectorFloats'][0]}, 'distance': 0}]
+        data = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def main(threads=32, requests_per_thread=200):
+    """run the check, returning the number of wrong responses"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = pymochow.MochowClient(Configuration(
+        credentials=BceCredentials('root', 'key'),
+        endpoint='http://127.0.0.1:%d' % server.server_port,
+        max_connections=8))
+    db = Database(client._conn, 'db', client._config)
+    table = Table(db, 'table', 1, None, None, config=client._config)
+    errors = []
+    start = threading.Barrier(threads)
+
+    def work(worker):
+        start.wait()
+        for i in range(requests_per_thread):
+            key = worker * requests_per_thread + i
+            try:
+                if i % 2:
+                    res = table.upsert([Row(id=key), Row(id=-key)])
+                    ok = res.ids == [key, -key]
+                else:
+                    res = table.search(AnnSearch('vector', [float(key)],
+                        HNSWSearchParams(ef=10, limit=1)))
+                    ok = res.rows[0]['row']['id'] == key
+                if not ok:
+                    errors.append((worker, i, 'wrong response'))
+            except Exception as e:
+                errors.append((worker, i, repr(e)))
+
+    began = time.monotonic()
+    workers = [threading.Thread(target=work, args=(w,)) for w in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - began
+    client.close()
+    server.shutdown()
+    total = threads * requests_per_thread
+    print('%d requests from %d threads in %.2fs (%.0f/s), %d errors'
+            % (total, threads, elapsed, total / elapsed, len(errors)))
+    for error in errors[:10]:
+        print(error)
+    return len(errors)
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main(*[int(arg) for arg in sys.argv[1:]]) else 0)
@@ -0,0 +1,185 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides an AIMD controller tuning bulk write batch size and concurrency.
+"""
+import collections
+import http.client
+import logging
+import socket
+import threading
+import time
+
+import requests
+
+from pymochow.exception import ServerError
+
+_logger = logging.getLogger(__name__)
+
+AimdDecision = collections.namedtuple('AimdDecision',
+        ['time', 'action', 'reason', 'batch_size', 'concurrency', 'row_latency'])
+
+
+def _is_overload(error):
+    """whether an error means the server or the network is overloaded"""
+    if isinstance(error, ServerError):
+        return error.status_code in (http.client.SERVICE_UNAVAILABLE,
+                http.client.TOO_MANY_REQUESTS)
+    return isinstance(error, (requests.exceptions.Timeout, socket.timeout, TimeoutError))
+
+
+class AimdController:
+    """
+    Tune batch size and concurrency of bulk writes with additive increase,
+    multiplicative decrease.
+
+    Batches are observed in rounds of concurrency batches. After a round
+    without errors whose per row latency is at most tolerance above the
+    baseline, an EWMA of earlier rounds, batch size grows by batch_step and
+    concurrency by one. A 503, 429 or timeout, or a round whose per row latency
+    exceeds latency_jump times the baseline, multiplies both by decrease; the
+    batches in flight when it happens are not counted after it, and a latency
+    decrease makes that latency the new baseline. Other errors
+    are not a load signal and are ignored.
+
+    Every change is logged, kept in decisions and passed to on_decision, to
+    export the operating point to a metrics system.
+
+    Args:
+        batch_size(int): initial rows per request
+        concurrency(int): initial requests in flight
+        min_batch_size(int): lower bound of batch size
+        max_batch_size(int): upper bound of batch size
+        min_concurrency(int): lower bound of concurrency
+        max_concurrency(int): upper bound of concurrency
+        batch_step(int): rows added to batch size on increase
+        decrease(float): factor applied on decrease
+        tolerance(float): latency growth still counted as no worse
+        latency_jump(float): latency growth counted as overload
+        on_decision(Optional[Callable[[AimdDecision], None]]): called on every change
+    """
+
+    def __init__(self, batch_size=100, concurrency=2, min_batch_size=10, max_batch_size=5000,
+            min_concurrency=1, max_concurrency=16, batch_step=50, decrease=0.5,
+            tolerance=0.1, latency_jump=2.0, on_decision=None):
+        if not 0 < min_batch_size <= batch_size <= max_batch_size:
+            raise ValueError('batch_size should be within [min_batch_size, max_batch_size]')
+        if not 0 < min_concurrency <= concurrency <= max_concurrency:
+            raise ValueError('concurrency should be within [min_concurrency, max_concurrency]')
+        if not 0 < decrease < 1:
+            raise ValueError('decrease should be within (0, 1)')
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._min_batch_size = min_batch_size
+        self._max_batch_size = max_batch_size
+        self._min_concurrency = min_concurrency
+        self._max_concurrency = max_concurrency
+        self._batch_step = batch_step
+        self._decrease = decrease
+        self._tolerance = tolerance
+        self._latency_jump = latency_jump
+        self._on_decision = on_decision
+
+        self._lock = threading.Lock()
+        self._baseline = None
+        self._round_rows = 0
+        self._round_latency = 0.0
+        self._round_batches = 0
+        # observations of batches sent before the last decrease, to skip
+        self._cooldown = 0
+        self.decisions = collections.deque(maxlen=1000)
+        self.increases = 0
+        self.decreases = 0
+
+    @property
+    def batch_size(self):
+        """rows of the next batch"""
+        return self._batch_size
+
+    @property
+    def concurrency(self):
+        """requests allowed in flight"""
+        return self._concurrency
+
+    def observe(self, rows, latency, error=None):
+        """
+        record a finished batch
+        Args:
+            rows(int): rows of the batch
+            latency(float): seconds the request took
+            error(Optional[Exception]): error of the request
+        """
+        with self._lock:
+            if self._cooldown > 0:
+                self._cooldown -= 1
+                return
+            if error is not None:
+                if _is_overload(error):
+                    self._decide_decrease(type(error).__name__, None)
+                return
+            self._round_rows += rows
+            self._round_latency += latency
+            self._round_batches += 1
+            if self._round_batches < self._concurrency:
+                return
+            row_latency = self._round_latency / max(self._round_rows, 1)
+            self._round_rows = 0
+            self._round_latency = 0.0
+            self._round_batches = 0
+            baseline = self._baseline
+            if baseline is None:
+                self._baseline = row_latency
+                self._decide_increase(row_latency)
+            elif row_latency > baseline * self._latency_jump:
+                # re-anchor, so that a lasting latency shift is one decrease and
+                # not a ratchet down to the floor
+                self._baseline = row_latency
+                self._decide_decrease('latency', row_latency)
+            else:
+                self._baseline = 0.7 * baseline + 0.3 * row_latency
+                if row_latency <= baseline * (1 + self._tolerance):
+                    self._decide_increase(row_latency)
+
+    def _decide_increase(self, row_latency):
+        batch_size = min(self._batch_size + self._batch_step, self._max_batch_size)
+        concurrency = min(self._concurrency + 1, self._max_concurrency)
+        if (batch_size, concurrency) == (self._batch_size, self._concurrency):
+            return
+        self.increases += 1
+        self._record('increase', 'latency', batch_size, concurrency, row_latency)
+
+    def _decide_decrease(self, reason, row_latency):
+        batch_size = max(int(self._batch_size * self._decrease), self._min_batch_size)
+        concurrency = max(int(self._concurrency * self._decrease), self._min_concurrency)
+        self._cooldown = self._concurrency
+        self._round_rows = 0
+        self._round_latency = 0.0
+        self._round_batches = 0
+        if (batch_size, concurrency) == (self._batch_size, self._concurrency):
+            return
+        self.decreases += 1
+        self._record('decrease', reason, batch_size, concurrency, row_latency)
+
+    def _record(self, action, reason, batch_size, concurrency, row_latency):
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        decision = AimdDecision(time.time(), action, reason, batch_size, concurrency,
+                row_latency)
+        self.decisions.append(decision)
+        _logger.info('bulk write %s on %s: batch_size=%d concurrency=%d row_latency=%s',
+                action, reason, batch_size, concurrency, row_latency)
+        if self._on_decision is not None:
+            try:
+                self._on_decision(decision)
+            except Exception:
+                _logger.exception('on_decision callback failed')
@@ -0,0 +1,201 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides an on-disk journal of committed chunks to resume bulk ingests.
+"""
+import bisect
+import logging
+import os
+import threading
+
+from pymochow.exception import ClientError
+
+_logger = logging.getLogger(__name__)
+
+_HEADER = '# pymochow checkpoint v1'
+
+
+class CheckpointJournal:
+    """
+    An append-only file recording the row ranges [start, end) of a source
+    which were committed, so that an interrupted ingest of the same source
+    skips them when restarted. Row positions are positions in the source, so
+    the source should be replayed in the same order; upsert makes rewriting
+    the chunks in flight at the crash harmless.
+
+    The file holds a header line naming the source and one "start end" line
+    per committed chunk. A torn last line, left by a crash while appending,
+    is ignored and dropped from the file. The journal is compacted to merged
+    ranges when opened.
+
+    Args:
+        path(str): path of the journal file, created when missing
+        source(Optional[str]): identity of the source, checked against the
+            one recorded in an existing journal
+        sync(bool): fsync after every record, to survive machine crashes
+            besides process crashes
+    """
+
+    def __init__(self, path, source=None, sync=False):
+        self._path = path
+        self._source = source
+        self._sync = sync
+        self._lock = threading.Lock()
+        # sorted disjoint committed ranges, as parallel lists
+        self._starts = []
+        self._ends = []
+        records, clean = self._load()
+        if not clean or records > len(self._starts):
+            self._rewrite()
+        self._file = open(path, 'a', encoding='utf-8')
+        if records == 0 and self._file.tell() == 0:
+            self._file.write(self._header())
+            self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def path(self):
+        """path of the journal file"""
+        return self._path
+
+    def _header(self):
+        return '%s %s\n' % (_HEADER, self._source or '')
+
+    def _load(self):
+        """
+        read an existing journal
+        Returns:
+            Tuple[int, bool]: the number of records, and whether every line
+                was valid, when False the file should be rewritten before
+                appending to it
+        """
+        try:
+            f = open(self._path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return 0, True
+        records = 0
+        clean = True
+        with f:
+            header = f.readline()
+            if header and not header.endswith('\n') and _HEADER.startswith(header):
+                _logger.debug('skip torn checkpoint header %r', header)
+                return 0, False
+            if header and header.startswith(_HEADER):
+                source = header[len(_HEADER):].strip() or None
+                if self._source is not None and source is not None and source != self._source:
+                    raise ClientError('checkpoint journal %s belongs to source %s, not %s'
+                            % (self._path, source, self._source))
+                if self._source is None:
+                    self._source = source
+            elif header:
+                raise ClientError('%s is not a checkpoint journal' % self._path)
+            if not header.endswith('\n'):
+                clean = False
+            for line in f:
+                parts = line.split()
+                try:
+                    if not line.endswith('\n') or len(parts) != 2:
+                        raise ValueError('torn record')
+                    start, end = int(parts[0]), int(parts[1])
+                except ValueError:
+                    _logger.debug('skip torn checkpoint record %r', line)
+                    clean = False
+                    continue
+                self._add(start, end)
+                records += 1
+        return records, clean
+
+    def _rewrite(self):
+        """replace the journal by its merged ranges"""
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self._header())
+            for start, end in zip(self._starts, self._ends):
+                f.write('%d %d\n' % (start, end))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path)
+
+    def _add(self, start, end):
+        """merge [start, end) into the committed ranges"""
+        if start >= end:
+            return
+        i = bisect.bisect_left(self._ends, start)
+        j = bisect.bisect_right(self._starts, end)
+        if i < j:
+            start = min(start, self._starts[i])
+            end = max(end, self._ends[j - 1])
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+    def record(self, start, end):
+        """
+        record rows [start, end) as committed
+        """
+        with self._lock:
+            self._add(start, end)
+            self._file.write('%d %d\n' % (start, end))
+            self._file.flush()
+            if self._sync:
+                os.fsync(self._file.fileno())
+
+    def committed(self):
+        """
+        Returns:
+            List[Tuple[int, int]]: the merged committed ranges
+        """
+        with self._lock:
+            return list(zip(self._starts, self._ends))
+
+    def is_committed(self, start, end):
+        """whether rows [start, end) are all committed"""
+        with self._lock:
+            i = bisect.bisect_right(self._starts, start) - 1
+            return i >= 0 and self._ends[i] >= end
+
+    def pending(self, total):
+        """
+        Args:
+            total(int): number of rows of the source
+        Returns:
+            List[Tuple[int, int]]: the ranges of [0, total) not committed yet
+        """
+        ranges = []
+        position = 0
+        with self._lock:
+            for start, end in zip(self._starts, self._ends):
+                if start >= total:
+                    break
+                if start > position:
+                    ranges.append((position, start))
+                position = max(position, end)
+        if position < total:
+            ranges.append((position, total))
+        return ranges
+
+    def resume_offset(self):
+        """position of the first row not committed"""
+        with self._lock:
+            if self._starts and self._starts[0] == 0:
+                return self._ends[0]
+            return 0
+
+    def close(self):
+        """close the journal file"""
+        with self._lock:
+            self._file.close()
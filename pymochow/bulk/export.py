@@ -0,0 +1,281 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides a streaming exporter of table rows to parquet or npy and jsonl files.
+"""
+import array
+import collections
+import logging
+import sys
+import time
+
+import orjson
+
+from pymochow.bulk.importer import _vector_field
+from pymochow.bulk.scan import scan, parallel_scan
+from pymochow.exception import ClientError
+from pymochow.model.enum import FieldType, ReadConsistency
+
+_logger = logging.getLogger(__name__)
+
+ExportProgress = collections.namedtuple('ExportProgress', ['rows', 'elapsed', 'rows_per_second'])
+
+FORMAT_PARQUET = 'parquet'
+FORMAT_NPY_JSONL = 'npy+jsonl'
+
+# arrow type of each scalar field type, other types are exported as strings
+_ARROW_TYPES = {
+    FieldType.BOOL.value: 'bool_',
+    FieldType.INT8.value: 'int8',
+    FieldType.UINT8.value: 'uint8',
+    FieldType.INT16.value: 'int16',
+    FieldType.UINT16.value: 'uint16',
+    FieldType.INT32.value: 'int32',
+    FieldType.UINT32.value: 'uint32',
+    FieldType.INT64.value: 'int64',
+    FieldType.UINT64.value: 'uint64',
+    FieldType.FLOAT.value: 'float32',
+    FieldType.DOUBLE.value: 'float64',
+}
+
+_NPY_MAGIC = b'\x93NUMPY\x01\x00'
+# the header is written once the shape is known, in a fixed size block
+_NPY_HEADER_SIZE = 128
+
+
+def _npy_header(rows, dimension):
+    """a version 1.0 .npy header of _NPY_HEADER_SIZE bytes for a float32 matrix"""
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dimension)
+    padding = _NPY_HEADER_SIZE - len(_NPY_MAGIC) - 2 - len(header) - 1
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    return _NPY_MAGIC + len(header).to_bytes(2, 'little') + header
+
+
+class _NpyJsonlSink:
+    """write vectors to <path>.npy and the other fields to <path>.jsonl"""
+
+    def __init__(self, path, vector_field):
+        self._vector_field = vector_field
+        self._vectors = open(path + '.npy', 'wb')
+        self._vectors.write(b'\0' * _NPY_HEADER_SIZE)
+        self._fields = open(path + '.jsonl', 'wb')
+        self._rows = 0
+        self._dimension = None
+
+    def write(self, rows):
+        floats = array.array('f')
+        lines = []
+        for row in rows:
+            row = dict(row)
+            vector = row.pop(self._vector_field, None)
+            if vector is None:
+                raise ClientError('row has no vector field %s, add it to projections'
+                        % self._vector_field)
+            if self._dimension is None:
+                self._dimension = len(vector)
+            elif len(vector) != self._dimension:
+                raise ClientError('vector has dimension %d, expecting %d'
+                        % (len(vector), self._dimension))
+            floats.extend(vector)
+            lines.append(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE))
+        if sys.byteorder != 'little':
+            floats.byteswap()
+        floats.tofile(self._vectors)
+        self._fields.write(b''.join(lines))
+        self._rows += len(rows)
+
+    def close(self):
+        self._vectors.seek(0)
+        self._vectors.write(_npy_header(self._rows, self._dimension or 0))
+        self._vectors.close()
+        self._fields.close()
+
+
+def _arrow_schema(pyarrow, fields, projections):
+    """
+    the arrow schema of the projected fields of a table schema, so that
+    columns keep their type whatever the values of the first row group
+    """
+    by_name = {field.field_name: field for field in fields}
+    arrow_fields = []
+    for name in projections:
+        field = by_name.get(name)
+        if field is None:
+            raise ClientError('field %s is not in the table schema' % name)
+        field_type = field.field_type
+        if isinstance(field_type, FieldType):
+            field_type = field_type.value
+        if field_type == FieldType.FLOAT_VECTOR.value:
+            arrow_type = pyarrow.list_(pyarrow.float32())
+        else:
+            arrow_type = getattr(pyarrow, _ARROW_TYPES.get(field_type, 'string'))()
+        arrow_fields.append(pyarrow.field(name, arrow_type))
+    return pyarrow.schema(arrow_fields)
+
+
+class _ParquetSink:
+    """
+    write rows to a parquet file, one row group per row_group_size rows. The
+    arrow schema is built from the table schema when it is known, and
+    inferred from the first row group otherwise.
+    """
+
+    def __init__(self, path, vector_field, row_group_size, fields=None, projections=None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ClientError('writing parquet requires the pyarrow package')
+        self._pyarrow = pyarrow
+        self._parquet = pyarrow.parquet
+        self._path = path
+        self._vector_field = vector_field
+        self._row_group_size = row_group_size
+        self._buffer = []
+        self._writer = None
+        self._schema = None
+        if fields is not None and projections is not None:
+            self._schema = _arrow_schema(pyarrow, fields, projections)
+
+    def write(self, rows):
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self._row_group_size:
+            self._write_group()
+
+    def _write_group(self):
+        if not self._buffer:
+            return
+        pyarrow = self._pyarrow
+        if self._writer is None and self._schema is not None:
+            table = pyarrow.Table.from_pylist(self._buffer, schema=self._schema)
+            self._writer = self._parquet.ParquetWriter(self._path, self._schema)
+        elif self._writer is None:
+            table = pyarrow.Table.from_pylist(self._buffer)
+            schema = table.schema
+            index = schema.get_field_index(self._vector_field)
+            if index >= 0:
+                schema = schema.set(index,
+                        pyarrow.field(self._vector_field, pyarrow.list_(pyarrow.float32())))
+                table = table.cast(schema)
+            self._writer = self._parquet.ParquetWriter(self._path, schema)
+        else:
+            table = pyarrow.Table.from_pylist(self._buffer, schema=self._writer.schema)
+        self._writer.write_table(table, row_group_size=len(self._buffer))
+        self._buffer = []
+
+    def close(self):
+        self._write_group()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class Exporter:
+    """
+    Export the rows of a table to files, streaming them page by page with the
+    next page prefetched while the current one is written, or with splits of
+    the table scanned in parallel.
+
+    Formats:
+        parquet: one parquet file, scalar fields in columns and the vector in
+            a list<float32> column, one row group per row_group_size rows.
+            Needs pyarrow.
+        npy+jsonl: the vectors in <path>.npy, a contiguous float32 matrix
+            which can be memory-mapped (see NpyMatrix), and the other fields
+            in <path>.jsonl, one row per line, as read by Table.import_from.
+
+    Args:
+        table(Table): the table to export
+        format(str): parquet or npy+jsonl
+        projections(Optional[List[str]]): fields to export, every field of the
+            table schema by default, should include the vector field for
+            npy+jsonl
+        filter(Optional[str]): filter of the rows to export
+        vector_field(Optional[str]): name of the vector field, found in the
+            table schema by default
+        batch_size(int): rows per select
+        row_group_size(int): rows per parquet row group
+        progress(Optional[Callable[[ExportProgress], None]]): called after every page
+        read_consistency(ReadConsistency): read consistency
+        config(Optional[Configuration]): client configuration
+        splits(Optional[List[str]]): disjoint filters scanned in parallel (see
+            parallel_scan), rows being written in no particular order
+        concurrency(Optional[int]): splits scanned at once
+    """
+
+    def __init__(self, table, format=FORMAT_PARQUET, projections=None, filter=None,
+            vector_field=None, batch_size=1000, row_group_size=100000, progress=None,
+            read_consistency=ReadConsistency.EVENTUAL, config=None, splits=None,
+            concurrency=None):
+        if format not in (FORMAT_PARQUET, FORMAT_NPY_JSONL):
+            raise ValueError('format should be %s or %s' % (FORMAT_PARQUET, FORMAT_NPY_JSONL))
+        if projections is None and table.schema is not None:
+            projections = [field.field_name for field in table.schema.fields]
+        self._table = table
+        self._format = format
+        self._projections = projections
+        self._filter = filter
+        self._vector_field = vector_field
+        self._batch_size = batch_size
+        self._row_group_size = row_group_size
+        self._progress = progress
+        self._read_consistency = read_consistency
+        self._config = config
+        self._splits = splits
+        self._concurrency = concurrency
+
+    def _pages(self):
+        if self._splits is None:
+            return scan(self._table, filter=self._filter, projections=self._projections,
+                    batch_size=self._batch_size, read_consistency=self._read_consistency,
+                    config=self._config)
+        return (page.rows for page in parallel_scan(self._table, self._splits,
+                filter=self._filter, projections=self._projections,
+                batch_size=self._batch_size, concurrency=self._concurrency,
+                read_consistency=self._read_consistency, config=self._config))
+
+    def run(self, path):
+        """
+        export the rows
+        Args:
+            path(str): the parquet file, or the path of the .npy and .jsonl files
+                without extension
+        Returns:
+            ExportProgress: rows exported, seconds taken and throughput
+        """
+        vector_field = self._vector_field
+        if vector_field is None:
+            try:
+                vector_field = _vector_field(self._table)
+            except ClientError:
+                if self._format == FORMAT_NPY_JSONL:
+                    raise
+        if self._format == FORMAT_PARQUET:
+            fields = self._table.schema.fields if self._table.schema is not None else None
+            sink = _ParquetSink(path, vector_field, self._row_group_size, fields,
+                    self._projections)
+        else:
+            sink = _NpyJsonlSink(path, vector_field)
+        began = time.monotonic()
+        progress = ExportProgress(0, 0.0, 0.0)
+        try:
+            for rows in self._pages():
+                sink.write(rows)
+                elapsed = time.monotonic() - began
+                total = progress.rows + len(rows)
+                progress = ExportProgress(total, elapsed, total / elapsed if elapsed > 0 else 0.0)
+                _logger.debug('exported %d rows, %.1f rows/s', total, progress.rows_per_second)
+                if self._progress is not None:
+                    self._progress(progress)
+        finally:
+            sink.close()
+        return progress
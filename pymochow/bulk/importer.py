@@ -0,0 +1,326 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides a streaming importer of vector matrices and row metadata into tables.
+"""
+import ast
+import itertools
+import logging
+import mmap
+import struct
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import util
+
+import orjson
+
+from pymochow.bulk.ingest import IngestResult, _chunks, _matrix_shape
+from pymochow.exception import ClientError
+from pymochow.model.enum import FieldType
+from pymochow.model.table import Row
+
+_logger = logging.getLogger(__name__)
+
+_NPY_MAGIC = b'\x93NUMPY'
+_NPY_FLOAT32 = ('<f4', '=f4', 'f4') if sys.byteorder == 'little' else ('>f4', '=f4', 'f4')
+
+
+class NpyMatrix:
+    """
+    A float32 .npy matrix memory-mapped read only, without numpy. Rows are
+    read from the page cache on demand, so the file may be larger than memory.
+
+    Args:
+        path(str): path of a C ordered 2-d float32 .npy file
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(_NPY_MAGIC)) != _NPY_MAGIC:
+                raise ClientError('%s is not a .npy file' % path)
+            major = f.read(2)[0]
+            if major == 1:
+                header_size = struct.unpack('<H', f.read(2))[0]
+            else:
+                header_size = struct.unpack('<I', f.read(4))[0]
+            header = ast.literal_eval(f.read(header_size).decode('latin1'))
+            offset = f.tell()
+            if header['descr'] not in _NPY_FLOAT32 or header['fortran_order'] \
+                    or len(header['shape']) != 2:
+                raise ClientError('%s should hold a C ordered 2-d float32 matrix, not %s'
+                        % (path, header))
+            self._rows, self._dimension = header['shape']
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._floats = memoryview(self._mmap)[offset:
+                offset + self._rows * self._dimension * 4].cast('f')
+
+    @property
+    def shape(self):
+        """(rows, dimension)"""
+        return self._rows, self._dimension
+
+    def __len__(self):
+        return self._rows
+
+    def vectors(self, start, end):
+        """
+        Returns:
+            List[List[float]]: the vectors of rows [start, end)
+        """
+        dimension = self._dimension
+        floats = self._floats[start * dimension:end * dimension].tolist()
+        return [floats[i:i + dimension] for i in range(0, len(floats), dimension)]
+
+    def close(self):
+        """unmap the file"""
+        self._floats.release()
+        self._mmap.close()
+
+
+def _vectors(matrix, start, end):
+    """the vectors of rows [start, end) of a matrix, as lists"""
+    if isinstance(matrix, NpyMatrix):
+        return matrix.vectors(start, end)
+    block = matrix[start:end]
+    if hasattr(block, 'tolist'):
+        return block.tolist()
+    return [list(vector) for vector in block]
+
+
+def _build_rows(matrix, start, end, fields, vector_field, id_field):
+    """the rows [start, end) zipped from the matrix and their metadata"""
+    rows = []
+    for i, vector in enumerate(_vectors(matrix, start, end)):
+        data = dict(fields[i]) if fields is not None else {}
+        data[vector_field] = vector
+        if id_field is not None:
+            data[id_field] = start + i
+        rows.append(Row(**data))
+    return rows
+
+
+# the state of an import worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(path, table, vector_field, id_field, upsert, config):
+    """map the .npy file once per worker process"""
+    matrix = NpyMatrix(path)
+    _worker.update(matrix=matrix, table=table, vector_field=vector_field,
+            id_field=id_field, upsert=upsert, config=config)
+    util.Finalize(None, matrix.close, exitpriority=10)
+
+
+def _write_chunk(start, end, fields):
+    """build and send the rows [start, end) in a worker process"""
+    rows = _build_rows(_worker['matrix'], start, end, fields, _worker['vector_field'],
+            _worker['id_field'])
+    try:
+        if _worker['upsert']:
+            _worker['table'].upsert(rows, config=_worker['config'])
+        else:
+            _worker['table'].insert(rows, config=_worker['config'])
+    except Exception as e:
+        # exceptions of the sdk are not always picklable, send back a description
+        return '%s: %s' % (type(e).__name__, e)
+    return None
+
+
+def iter_metadata(metadata, batch_size=1024):
+    """
+    iterate the rows of a metadata source
+    Args:
+        metadata: path of a .parquet file (read by row batches, needs pyarrow)
+            or a .jsonl file (one JSON object per line), or an iterable of dicts
+        batch_size(int): rows per parquet batch
+    Returns:
+        Iterator[dict]: the metadata of each row, in order
+    """
+    if not isinstance(metadata, str):
+        yield from metadata
+        return
+    if metadata.endswith('.parquet'):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ClientError('reading parquet requires the pyarrow package')
+        parquet_file = pyarrow.parquet.ParquetFile(metadata)
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield from batch.to_pylist()
+    elif metadata.endswith('.jsonl'):
+        with open(metadata, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield orjson.loads(line)
+    else:
+        raise ClientError('unsupported metadata source %s' % metadata)
+
+
+def _vector_field(table):
+    """name of the vector field in the schema of a table"""
+    if table.schema is not None:
+        for field in table.schema.fields:
+            if field.field_type in (FieldType.FLOAT_VECTOR, FieldType.FLOAT_VECTOR.value):
+                return field.field_name
+    raise ClientError('vector_field is required when the table schema is unknown')
+
+
+class Importer:
+    """
+    Import a vector matrix and its row metadata into a table with bounded
+    memory.
+
+    Vectors are memory-mapped (a .npy path, or any sliceable matrix such as a
+    numpy memmap) and metadata is streamed (see iter_metadata). Rows are
+    zipped lazily chunk by chunk and written concurrently, with at most
+    concurrency chunks built or in flight, so resident memory is bounded by
+    concurrency * chunk_size rows whatever the size of the dataset.
+
+    By default chunks are built and encoded on the client's shared thread
+    executor, where the GIL limits row building and JSON encoding to one core.
+    With processes, vectors should be a .npy path: every worker process of a
+    pool maps the file itself and builds and sends its chunks, as
+    ProcessPoolIngester does from shared memory, and only the metadata of a
+    chunk is sent to it.
+
+    Args:
+        table(Table): the table to write
+        vector_field(Optional[str]): name of the vector field, found in the
+            table schema by default
+        id_field(Optional[str]): field set to the row position, for sources
+            whose metadata has no primary key
+        chunk_size(int): rows per insert/upsert request
+        concurrency(Optional[int]): chunks in flight, the size of the shared
+            executor by default
+        upsert(bool): upsert rows, or insert them when False
+        config(Optional[Configuration]): client configuration
+        processes(Optional[int]): write from that many worker processes, chunks
+            in flight being twice that by default
+        mp_context: multiprocessing context of the worker processes
+    """
+
+    def __init__(self, table, vector_field=None, id_field=None, chunk_size=500,
+            concurrency=None, upsert=True, config=None, processes=None, mp_context=None):
+        if chunk_size <= 0:
+            raise ValueError('chunk_size should be a positive integer')
+        if processes is not None and processes <= 0:
+            raise ValueError('processes should be a positive integer')
+        self._table = table
+        self._vector_field = vector_field or _vector_field(table)
+        self._id_field = id_field
+        self._chunk_size = chunk_size
+        self._concurrency = concurrency
+        self._upsert = upsert
+        self._config = config
+        self._processes = processes
+        self._mp_context = mp_context
+
+    def run(self, vectors, metadata=None, journal=None):
+        """
+        import rows
+        Args:
+            vectors: path of a .npy file, or a 2-d matrix
+            metadata: metadata source aligned with vectors, see iter_metadata
+            journal(Optional[CheckpointJournal]): skip the rows it records as
+                committed and record the chunks written
+        Returns:
+            IngestResult: rows written and failed chunks
+        """
+        matrix = NpyMatrix(vectors) if isinstance(vectors, str) else vectors
+        try:
+            if self._processes is None:
+                executor = self._table.conn.executor
+                return self._run(matrix, metadata, journal, executor,
+                        lambda start, end, fields: executor.submit(
+                            self._send_chunk, matrix, start, end, fields))
+            if not isinstance(vectors, str):
+                raise ClientError('vectors should be a .npy path to import with processes')
+            with ProcessPoolExecutor(max_workers=self._processes,
+                    mp_context=self._mp_context, initializer=_init_worker,
+                    initargs=(vectors, self._table, self._vector_field, self._id_field,
+                        self._upsert, self._config)) as executor:
+                return self._run(matrix, metadata, journal, executor,
+                        lambda start, end, fields: executor.submit(
+                            _write_chunk, start, end, fields))
+        finally:
+            if matrix is not vectors:
+                matrix.close()
+
+    def _run(self, matrix, metadata, journal, executor, submit):
+        """
+        write the pending chunks, submit(start, end, fields) returning the
+        future of a chunk, which holds the error description of a failed
+        chunk written by a worker process
+        """
+        rows, _ = _matrix_shape(matrix)
+        result = IngestResult()
+        ranges = journal.pending(rows) if journal is not None else [(0, rows)]
+        result.add_skipped(rows - sum(end - start for start, end in ranges))
+        workers = getattr(executor, '_max_workers', 1)
+        slots = threading.Semaphore(self._concurrency
+                or (workers if self._processes is None else 2 * workers))
+        cond = threading.Condition()
+        inflight = [0]
+
+        def done(start, end, future):
+            error = future.exception() or future.result()
+            with cond:
+                if error is None:
+                    result.add_success(end - start)
+                    if journal is not None:
+                        journal.record(start, end)
+                else:
+                    _logger.debug('import of rows [%d, %d) failed: %s', start, end, error)
+                    result.add_failure(start, end, error)
+                inflight[0] -= 1
+                cond.notify_all()
+            slots.release()
+
+        fields = iter_metadata(metadata, self._chunk_size) if metadata is not None else None
+        position = 0
+        try:
+            for start, end in _chunks(ranges, self._chunk_size):
+                slots.acquire()
+                chunk_fields = None
+                if fields is not None:
+                    # skip the metadata of committed rows
+                    for _ in itertools.islice(fields, start - position):
+                        pass
+                    chunk_fields = list(itertools.islice(fields, end - start))
+                    if len(chunk_fields) != end - start:
+                        slots.release()
+                        raise ClientError('metadata has fewer rows than vectors')
+                position = end
+                try:
+                    future = submit(start, end, chunk_fields)
+                except Exception:
+                    slots.release()
+                    raise
+                with cond:
+                    inflight[0] += 1
+                future.add_done_callback(lambda f, start=start, end=end: done(start, end, f))
+        finally:
+            # chunks in flight read the matrix, which the caller may close
+            with cond:
+                while inflight[0]:
+                    cond.wait()
+        return result
+
+    def _send_chunk(self, matrix, start, end, fields):
+        """build and send a chunk on the shared thread executor"""
+        rows = _build_rows(matrix, start, end, fields, self._vector_field, self._id_field)
+        if self._upsert:
+            self._table.upsert(rows, config=self._config)
+        else:
+            self._table.insert(rows, config=self._config)
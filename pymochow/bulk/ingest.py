@@ -0,0 +1,279 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides a multi process ingest driver for tables.
+"""
+import array
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import shared_memory, util
+
+from pymochow.exception import ClientError
+from pymochow.model.table import Row
+
+_logger = logging.getLogger(__name__)
+
+_FLOAT32_SIZE = 4
+
+
+class ChunkFailure:
+    """
+    A chunk of rows [start, end) which failed to be written.
+    """
+    def __init__(self, start, end, error, rows=None):
+        self._start = start
+        self._end = end
+        self._error = error
+        self._rows = rows
+
+    @property
+    def start(self):
+        """index of the first row of the chunk"""
+        return self._start
+
+    @property
+    def end(self):
+        """index after the last row of the chunk"""
+        return self._end
+
+    @property
+    def error(self):
+        """the error, or its description when raised in another process"""
+        return self._error
+
+    @property
+    def rows(self):
+        """the rows of the chunk, when known"""
+        return self._rows
+
+    def __repr__(self):
+        return 'ChunkFailure(start=%d, end=%d, error=%r)' % (self._start, self._end, self._error)
+
+
+class IngestResult:
+    """
+    Result of a bulk ingest.
+    """
+    def __init__(self):
+        self._rows_succeeded = 0
+        self._rows_skipped = 0
+        self._failures = []
+
+    @property
+    def rows_succeeded(self):
+        """number of rows written"""
+        return self._rows_succeeded
+
+    @property
+    def rows_skipped(self):
+        """number of rows skipped as already committed in a checkpoint journal"""
+        return self._rows_skipped
+
+    @property
+    def failures(self):
+        """List[ChunkFailure]: the failed chunks, ordered by start"""
+        return sorted(self._failures, key=lambda f: f.start)
+
+    def add_success(self, rows):
+        """record rows written"""
+        self._rows_succeeded += rows
+
+    def add_skipped(self, rows):
+        """record rows skipped"""
+        self._rows_skipped += rows
+
+    def add_failure(self, start, end, error, rows=None):
+        """record a failed chunk"""
+        self._failures.append(ChunkFailure(start, end, error, rows))
+
+    def __repr__(self):
+        return 'IngestResult(rows_succeeded=%d, failures=%d)' % (
+                self._rows_succeeded, len(self._failures))
+
+
+# the state of an ingest worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(shm_name, rows, dimension, table, vector_field, upsert):
+    """attach the vector matrix once per worker process"""
+    # the resource tracker is shared with the parent, which owns and unlinks the block
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['shm'] = shm
+    _worker['vectors'] = shm.buf[:rows * dimension * _FLOAT32_SIZE].cast('f')
+    _worker['dimension'] = dimension
+    _worker['table'] = table
+    _worker['vector_field'] = vector_field
+    _worker['upsert'] = upsert
+    util.Finalize(None, _release_worker, exitpriority=10)
+
+
+def _release_worker():
+    """release the shared vector matrix when the worker process exits"""
+    vectors = _worker.pop('vectors', None)
+    if vectors is not None:
+        vectors.release()
+    shm = _worker.pop('shm', None)
+    if shm is not None:
+        shm.close()
+
+
+def _write_chunk(start, end, fields):
+    """build and send the rows [start, end) from the shared vector matrix"""
+    vectors = _worker['vectors']
+    dimension = _worker['dimension']
+    vector_field = _worker['vector_field']
+    rows = []
+    for i in range(start, end):
+        data = dict(fields[i - start]) if fields is not None else {}
+        data[vector_field] = vectors[i * dimension:(i + 1) * dimension].tolist()
+        rows.append(Row(**data))
+    try:
+        if _worker['upsert']:
+            _worker['table'].upsert(rows)
+        else:
+            _worker['table'].insert(rows)
+    except Exception as e:
+        # exceptions of the sdk are not always picklable, send back a description
+        return start, end, '%s: %s' % (type(e).__name__, e)
+    return start, end, None
+
+
+class ProcessPoolIngester:
+    """
+    Ingest a vector matrix into a table with a pool of worker processes.
+
+    The float32 vector matrix is copied once into a multiprocessing shared
+    memory block. Each worker attaches the block and builds and sends its own
+    insert/upsert bodies from row ranges of it, so JSON encoding runs on all
+    cores and vectors are never pickled. Only the scalar fields of a chunk and
+    the (cheaply picklable) table handle are sent to the workers.
+
+    Args:
+        table(Table): the table to write
+        vector_field(str): name of the vector field
+        processes(Optional[int]): number of worker processes, os.cpu_count() by default
+        chunk_size(int): rows per insert/upsert request
+        upsert(bool): upsert rows, or insert them when False
+        mp_context: multiprocessing context of the worker processes
+    """
+
+    def __init__(self, table, vector_field, processes=None, chunk_size=500,
+            upsert=True, mp_context=None):
+        if chunk_size <= 0:
+            raise ValueError('chunk_size should be a positive integer')
+        self._table = table
+        self._vector_field = vector_field
+        self._processes = processes
+        self._chunk_size = chunk_size
+        self._upsert = upsert
+        self._mp_context = mp_context
+
+    def ingest(self, vectors, fields=None, journal=None):
+        """
+        ingest rows
+        Args:
+            vectors: 2-d float32 matrix (an object supporting the buffer protocol
+                such as a numpy array), or a sequence of vectors
+            fields(Optional[Sequence[dict]]): scalar fields of each row, aligned with vectors
+            journal(Optional[CheckpointJournal]): skip the rows it records as
+                committed and record the chunks written
+        Returns:
+            IngestResult: rows written and failed chunks
+        """
+        rows, dimension = _matrix_shape(vectors)
+        if fields is not None and len(fields) != rows:
+            raise ClientError('fields should have one entry per vector')
+
+        result = IngestResult()
+        ranges = journal.pending(rows) if journal is not None else [(0, rows)]
+        result.add_skipped(rows - sum(end - start for start, end in ranges))
+        if not ranges:
+            return result
+
+        shm = shared_memory.SharedMemory(create=True, size=rows * dimension * _FLOAT32_SIZE)
+        try:
+            _copy_matrix(vectors, shm.buf, rows, dimension)
+            with ProcessPoolExecutor(max_workers=self._processes,
+                    mp_context=self._mp_context,
+                    initializer=_init_worker,
+                    initargs=(shm.name, rows, dimension, self._table,
+                        self._vector_field, self._upsert)) as executor:
+                max_pending = 2 * getattr(executor, '_max_workers', 1)
+                pending = set()
+                for start, end in _chunks(ranges, self._chunk_size):
+                    chunk_fields = fields[start:end] if fields is not None else None
+                    pending.add(executor.submit(_write_chunk, start, end, chunk_fields))
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self._collect(done, result, journal)
+                done, _ = wait(pending)
+                self._collect(done, result, journal)
+        finally:
+            shm.close()
+            shm.unlink()
+        return result
+
+    def _collect(self, futures, result, journal=None):
+        """collect the results of finished chunks"""
+        for future in futures:
+            start, end, error = future.result()
+            if error is None:
+                result.add_success(end - start)
+                if journal is not None:
+                    journal.record(start, end)
+            else:
+                _logger.debug('ingest chunk [%d, %d) failed: %s', start, end, error)
+                result.add_failure(start, end, error)
+
+
+def _chunks(ranges, chunk_size):
+    """cut row ranges into chunks of at most chunk_size rows"""
+    for start, end in ranges:
+        for chunk_start in range(start, end, chunk_size):
+            yield chunk_start, min(chunk_start + chunk_size, end)
+
+
+def _matrix_shape(vectors):
+    """rows and dimension of a vector matrix"""
+    shape = getattr(vectors, 'shape', None)
+    if shape is not None:
+        if len(shape) != 2:
+            raise ClientError('vectors should be a 2-d matrix')
+        return shape[0], shape[1]
+    rows = len(vectors)
+    return rows, (len(vectors[0]) if rows > 0 else 0)
+
+
+def _copy_matrix(vectors, buf, rows, dimension):
+    """copy the vector matrix into buf as contiguous float32"""
+    target = buf[:rows * dimension * _FLOAT32_SIZE]
+    try:
+        source = memoryview(vectors)
+    except TypeError:
+        source = None
+    try:
+        if source is not None and source.format == 'f' and source.c_contiguous:
+            target[:] = source.cast('B')
+            return
+        with target.cast('f') as floats:
+            for i in range(rows):
+                vector = vectors[i]
+                if len(vector) != dimension:
+                    raise ClientError('vector %d has dimension %d, expecting %d'
+                            % (i, len(vector), dimension))
+                floats[i * dimension:(i + 1) * dimension] = array.array('f', vector)
+    finally:
+        if source is not None:
+            source.release()
+        target.release()
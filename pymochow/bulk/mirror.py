@@ -0,0 +1,225 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides a table mirroring writes and sampled reads to a second cluster.
+"""
+import collections
+import logging
+import queue
+import random
+import threading
+import time
+
+import orjson
+
+_logger = logging.getLogger(__name__)
+
+ReadComparison = collections.namedtuple('ReadComparison',
+        ['op', 'overlap', 'match', 'primary_latency', 'secondary_latency'])
+
+_WRITES = ('insert', 'upsert', 'delete', 'update')
+_READS = ('query', 'search', 'batch_search', 'select')
+_STOP = object()
+
+
+class MirroredTable:
+    """
+    A table applying writes to a primary and a secondary table, e.g. of an old
+    and a new cluster, and comparing a sample of reads between them.
+
+    Calls return the result of the primary table as if it was used alone.
+    Writes are queued for the secondary table and applied in order by a
+    background thread; when max_pending writes wait, further ones are dropped
+    and counted. A read_sample_rate fraction of reads is repeated on the
+    secondary table on its client's shared executor after the primary call
+    returned, and compared; when max_pending_reads of them are in flight,
+    further ones are dropped and counted. Comparisons record the overlap of
+    the returned rows by primary key (recall of the primary rows), whether
+    they are equal, and both latencies.
+    Nothing of the secondary table is on the latency path or can fail a call.
+
+    metrics returns the aggregated comparisons and on_compare receives every
+    one, to publish them. Other attributes are those of the primary table.
+
+    Args:
+        primary(Table): the table serving the calls
+        secondary(Table): the mirror table
+        read_sample_rate(float): fraction of reads compared, within [0, 1]
+        max_pending(int): secondary writes waiting before dropping
+        max_pending_reads(int): sampled secondary reads in flight before dropping
+        on_compare(Optional[Callable[[ReadComparison], None]]): called on every comparison
+    """
+
+    def __init__(self, primary, secondary, read_sample_rate=0.01, max_pending=10000,
+            max_pending_reads=100, on_compare=None):
+        if not 0 <= read_sample_rate <= 1:
+            raise ValueError('read_sample_rate should be within [0, 1]')
+        self._primary = primary
+        self._secondary = secondary
+        self._read_sample_rate = read_sample_rate
+        self._on_compare = on_compare
+        self._key_fields = primary._primary_key_fields()
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._sums = collections.Counter()
+        self._writes = queue.Queue(max_pending)
+        self._reads = threading.BoundedSemaphore(max_pending_reads)
+        self._writer = threading.Thread(target=self._write_loop, name='pymochow-mirror',
+                daemon=True)
+        self._writer.start()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in _WRITES:
+            return lambda *args, **kwargs: self._write(name, args, kwargs)
+        if name in _READS:
+            return lambda *args, **kwargs: self._read(name, args, kwargs)
+        return getattr(self._primary, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def metrics(self):
+        """
+        Returns:
+            dict: writes_mirrored, writes_failed, writes_dropped, writes_pending,
+                reads_compared, reads_failed (secondary errors), reads_dropped,
+                reads_mismatched,
+                mean_overlap, mean_primary_latency and mean_secondary_latency
+                (seconds, of the compared reads)
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            sums = dict(self._sums)
+        compared = counters.get('reads_compared', 0)
+        metrics = {name: counters.get(name, 0) for name in ('writes_mirrored',
+            'writes_failed', 'writes_dropped', 'reads_compared', 'reads_failed',
+            'reads_dropped', 'reads_mismatched')}
+        metrics['writes_pending'] = self._writes.qsize()
+        for name in ('overlap', 'primary_latency', 'secondary_latency'):
+            metrics['mean_' + name] = sums.get(name, 0.0) / compared if compared else None
+        return metrics
+
+    def flush(self):
+        """wait until the queued secondary writes are applied"""
+        self._writes.join()
+
+    def close(self):
+        """apply the queued secondary writes and stop"""
+        self._writes.put(_STOP)
+        self._writer.join()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _write(self, op, args, kwargs):
+        # rows may be an iterator, read once for both tables
+        if op in ('insert', 'upsert'):
+            if args:
+                args = (list(args[0]),) + tuple(args[1:])
+            elif 'rows' in kwargs:
+                kwargs = dict(kwargs, rows=list(kwargs['rows']))
+        response = getattr(self._primary, op)(*args, **kwargs)
+        try:
+            self._writes.put_nowait((op, args, kwargs))
+        except queue.Full:
+            self._count('writes_dropped')
+        return response
+
+    def _write_loop(self):
+        while True:
+            item = self._writes.get()
+            try:
+                if item is _STOP:
+                    return
+                op, args, kwargs = item
+                try:
+                    getattr(self._secondary, op)(*args, **kwargs)
+                    self._count('writes_mirrored')
+                except Exception as e:
+                    _logger.debug('mirrored %s failed: %s', op, e)
+                    self._count('writes_failed')
+            finally:
+                self._writes.task_done()
+
+    def _read(self, op, args, kwargs):
+        began = time.monotonic()
+        response = getattr(self._primary, op)(*args, **kwargs)
+        primary_latency = time.monotonic() - began
+        if self._read_sample_rate and random.random() < self._read_sample_rate:
+            if not self._reads.acquire(blocking=False):
+                self._count('reads_dropped')
+                return response
+            try:
+                self._secondary.conn.executor.submit(self._compare, op, args, kwargs,
+                        response, primary_latency)
+            except Exception as e:
+                _logger.debug('mirrored %s not sent: %s', op, e)
+                self._reads.release()
+        return response
+
+    def _compare(self, op, args, kwargs, primary_response, primary_latency):
+        try:
+            self._compare_reads(op, args, kwargs, primary_response, primary_latency)
+        finally:
+            self._reads.release()
+
+    def _compare_reads(self, op, args, kwargs, primary_response, primary_latency):
+        began = time.monotonic()
+        try:
+            response = getattr(self._secondary, op)(*args, **kwargs)
+        except Exception as e:
+            _logger.debug('mirrored %s failed: %s', op, e)
+            self._count('reads_failed')
+            return
+        secondary_latency = time.monotonic() - began
+        try:
+            primary_rows = self._result_keys(op, primary_response)
+            secondary_rows = self._result_keys(op, response)
+            overlap = (len(set(primary_rows) & set(secondary_rows)) / len(set(primary_rows))
+                    if primary_rows else float(not secondary_rows))
+            comparison = ReadComparison(op, overlap, primary_rows == secondary_rows,
+                    primary_latency, secondary_latency)
+            with self._lock:
+                self._counters['reads_compared'] += 1
+                self._counters['reads_mismatched'] += not comparison.match
+                self._sums['overlap'] += overlap
+                self._sums['primary_latency'] += primary_latency
+                self._sums['secondary_latency'] += secondary_latency
+            if self._on_compare is not None:
+                self._on_compare(comparison)
+        except Exception:
+            _logger.exception('comparison of mirrored %s failed', op)
+
+    def _result_keys(self, op, response):
+        """the rows of a read response, as primary keys in order"""
+        if op == 'query':
+            rows = [getattr(response, 'row', None)]
+        elif op == 'batch_search':
+            rows = [item for result in getattr(response, 'results', None) or []
+                    for item in result.get('rows', [])]
+        else:
+            rows = getattr(response, 'rows', None) or []
+        # search results wrap rows with their distance and score
+        rows = [row.get('row', row) if isinstance(row, dict) else row for row in rows]
+        return [self._row_key(row) for row in rows if row is not None]
+
+    def _row_key(self, row):
+        if self._key_fields and all(name in row for name in self._key_fields):
+            row = {name: row[name] for name in self._key_fields}
+        return orjson.dumps(row, option=orjson.OPT_SORT_KEYS)
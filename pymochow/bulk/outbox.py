@@ -0,0 +1,375 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides a disk spilling outbox for writes made while a cluster is unreachable.
+"""
+import collections
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+import orjson
+
+from pymochow.exception import ClientError, ServerError, HttpClientError
+from pymochow.model.table import Row
+
+_logger = logging.getLogger(__name__)
+
+# length and crc32 of the payload
+_RECORD_HEADER = struct.Struct('>II')
+_SEGMENT_SUFFIX = '.seg'
+_CURSOR_FILE = 'cursor'
+# seconds of replay history the throughput is measured on
+_RATE_WINDOW_IN_SECONDS = 60
+
+
+def _is_transient(error):
+    """whether a write failed because the cluster is unreachable or overloaded"""
+    if isinstance(error, (IOError, HttpClientError)):
+        return True
+    if isinstance(error, ServerError):
+        return (error.status_code is None or error.status_code >= 500
+                or error.status_code == 429 or error.code == ServerError.REQUEST_EXPIRED)
+    return False
+
+
+def _read_record(f):
+    """read the record at the position of f, None at the end or on a torn record"""
+    header = f.read(_RECORD_HEADER.size)
+    if len(header) < _RECORD_HEADER.size:
+        return None
+    length, crc = _RECORD_HEADER.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length or zlib.crc32(payload) != crc:
+        return None
+    return payload
+
+
+class DurableOutbox:
+    """
+    Write rows to a table, keeping the writes which fail because the cluster
+    is unreachable in append-only segment files, and replaying them in order
+    from a background thread once the cluster is back.
+
+    insert, upsert and delete are sent directly while the outbox is empty.
+    A write failing after the retries of the client with an IO error, a 5xx
+    or a 429 is spilled to disk instead of raising; while older writes wait
+    in the outbox new writes are spilled too, so that writes are applied in
+    order. Other errors are raised to the caller. Replay is at least once: a
+    write replayed before a crash may be replayed again, which is harmless
+    for upsert and delete. A replayed write failing with a non transient
+    error is dropped and counted.
+
+    Args:
+        table(Table): the table to write
+        directory(str): directory of the segment files, created when missing
+        max_segment_bytes(int): size after which a new segment is started
+        max_bytes(int): size of the backlog after which writes raise ClientError
+        replay_interval_in_mills(int): pause after a failed replay
+        sync(bool): fsync after every spilled write and replay
+        config(Optional[Configuration]): client configuration
+    """
+
+    def __init__(self, table, directory, max_segment_bytes=64 * 1024 * 1024,
+            max_bytes=1024 * 1024 * 1024, replay_interval_in_mills=1000, sync=False,
+            config=None):
+        self._table = table
+        self._directory = directory
+        self._max_segment_bytes = max_segment_bytes
+        self._max_bytes = max_bytes
+        self._replay_interval = replay_interval_in_mills / 1000.0
+        self._sync = sync
+        self._config = config
+
+        self._cond = threading.Condition()
+        self._closed = False
+        self._spilled = 0
+        self._replayed = 0
+        self._replayed_rows = 0
+        self._dropped = 0
+        self._replay_history = collections.deque()
+        self._head_time = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._segments = sorted(int(name[:-len(_SEGMENT_SUFFIX)])
+                for name in os.listdir(directory) if name.endswith(_SEGMENT_SUFFIX))
+        self._cursor = self._load_cursor()
+        self._bytes = sum(os.path.getsize(self._segment_path(s)) for s in self._segments)
+        self._bytes -= self._cursor[1] if self._cursor[0] in self._segments else 0
+        self._open_writer()
+        self._reader = None
+        self._records = self._count_records()
+
+        self._replayer = threading.Thread(target=self._replay_loop,
+                name='pymochow-outbox', daemon=True)
+        self._replayer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def insert(self, rows):
+        """insert rows, see Table.insert; returns None when the write is spilled"""
+        # rows may be an iterator, read once for the spill payload and the send
+        rows = list(rows)
+        return self._write('insert', {'rows': [row.to_dict() for row in rows]},
+                lambda: self._table.insert(rows, config=self._config))
+
+    def upsert(self, rows):
+        """upsert rows, see Table.upsert; returns None when the write is spilled"""
+        rows = list(rows)
+        return self._write('upsert', {'rows': [row.to_dict() for row in rows]},
+                lambda: self._table.upsert(rows, config=self._config))
+
+    def delete(self, primary_key=None, partition_key=None, filter=None):
+        """delete rows, see Table.delete; returns None when the write is spilled"""
+        return self._write('delete',
+                {'primary_key': primary_key, 'partition_key': partition_key, 'filter': filter},
+                lambda: self._table.delete(primary_key=primary_key,
+                    partition_key=partition_key, filter=filter, config=self._config))
+
+    def metrics(self):
+        """
+        Returns:
+            dict: backlog_records, backlog_bytes, backlog_age_in_seconds (age of
+                the oldest write waiting, 0 when empty), spilled_records,
+                replayed_records, replayed_rows, dropped_records and
+                replay_rows_per_second over the last minute
+        """
+        now = time.time()
+        with self._cond:
+            history = self._replay_history
+            while history and history[0][0] < now - _RATE_WINDOW_IN_SECONDS:
+                history.popleft()
+            rate = 0.0
+            if history:
+                span = max(now - history[0][0], 1.0)
+                rate = sum(rows for _, rows in history) / span
+            return {
+                'backlog_records': self._records,
+                'backlog_bytes': self._bytes,
+                'backlog_age_in_seconds': (now - self._head_time
+                    if self._records and self._head_time is not None else 0),
+                'spilled_records': self._spilled,
+                'replayed_records': self._replayed,
+                'replayed_rows': self._replayed_rows,
+                'dropped_records': self._dropped,
+                'replay_rows_per_second': rate,
+            }
+
+    def flush(self, timeout=None):
+        """
+        wait until the backlog is replayed
+        Returns:
+            bool: whether the backlog is empty
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._records and not self._closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._records == 0
+
+    def close(self):
+        """stop the replayer, the backlog stays on disk for the next outbox"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._replayer.join()
+        with self._cond:
+            self._writer.close()
+            if self._reader is not None:
+                self._reader.close()
+
+    def _write(self, op, payload, send):
+        with self._cond:
+            if self._closed:
+                raise ClientError('outbox is closed')
+            backlog = self._records > 0
+        if not backlog:
+            try:
+                return send()
+            except Exception as e:
+                if not _is_transient(e):
+                    raise
+                _logger.warning('spill %s to outbox %s: %s', op, self._directory, e)
+        payload['op'] = op
+        payload['time'] = time.time()
+        self._spill(orjson.dumps(payload), payload['time'])
+        return None
+
+    def _spill(self, payload, created):
+        record = _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._cond:
+            if self._bytes + len(record) > self._max_bytes:
+                raise ClientError('outbox %s is full' % self._directory)
+            if self._writer.tell() + len(record) > self._max_segment_bytes \
+                    and self._writer.tell() > 0:
+                self._writer.close()
+                self._segments.append(self._segments[-1] + 1)
+                self._open_writer()
+            self._writer.write(record)
+            self._writer.flush()
+            if self._sync:
+                os.fsync(self._writer.fileno())
+            self._bytes += len(record)
+            if self._records == 0:
+                self._head_time = created
+            self._records += 1
+            self._spilled += 1
+            self._cond.notify_all()
+
+    def _segment_path(self, segment):
+        return os.path.join(self._directory, '%020d%s' % (segment, _SEGMENT_SUFFIX))
+
+    def _load_cursor(self):
+        """the segment and offset of the next write to replay"""
+        try:
+            with open(os.path.join(self._directory, _CURSOR_FILE), 'r') as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except (FileNotFoundError, ValueError):
+            return (self._segments[0] if self._segments else 0), 0
+
+    def _save_cursor(self):
+        path = os.path.join(self._directory, _CURSOR_FILE)
+        with open(path + '.tmp', 'w') as f:
+            f.write('%d %d' % self._cursor)
+            if self._sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _open_writer(self):
+        """open the last segment for appending, cutting a torn last record"""
+        if not self._segments:
+            self._segments.append(0)
+        path = self._segment_path(self._segments[-1])
+        self._writer = open(path, 'ab')
+        with open(path, 'rb') as f:
+            valid = 0
+            while _read_record(f) is not None:
+                valid = f.tell()
+        if valid < self._writer.tell():
+            _logger.warning('cut torn record at %s:%d', path, valid)
+            self._bytes -= self._writer.tell() - valid
+            self._writer.truncate(valid)
+            self._writer.seek(valid)
+
+    def _count_records(self):
+        """count the writes waiting and find the time of the oldest"""
+        records = 0
+        for segment in self._segments:
+            if segment < self._cursor[0]:
+                continue
+            with open(self._segment_path(segment), 'rb') as f:
+                if segment == self._cursor[0]:
+                    f.seek(self._cursor[1])
+                while True:
+                    payload = _read_record(f)
+                    if payload is None:
+                        break
+                    if records == 0:
+                        self._head_time = orjson.loads(payload).get('time')
+                    records += 1
+        return records
+
+    def _next(self):
+        """the next write to replay and its size, None when the backlog is empty"""
+        while True:
+            segment, offset = self._cursor
+            if self._reader is None:
+                if segment not in self._segments:
+                    later = [s for s in self._segments if s > segment]
+                    if not later:
+                        return None
+                    self._cursor = (later[0], 0)
+                    continue
+                self._reader = open(self._segment_path(segment), 'rb')
+            self._reader.seek(offset)
+            payload = _read_record(self._reader)
+            if payload is not None:
+                return payload, self._reader.tell() - offset
+            if segment == self._segments[-1]:
+                return None
+            # a finished segment, drop it
+            self._reader.close()
+            self._reader = None
+            os.remove(self._segment_path(segment))
+            self._segments.remove(segment)
+            self._cursor = (self._segments[0], 0)
+            self._save_cursor()
+
+    def _apply(self, write):
+        op = write['op']
+        if op == 'insert':
+            self._table.insert([Row(**row) for row in write['rows']], config=self._config)
+        elif op == 'upsert':
+            self._table.upsert([Row(**row) for row in write['rows']], config=self._config)
+        elif op == 'delete':
+            self._table.delete(primary_key=write['primary_key'],
+                    partition_key=write['partition_key'], filter=write['filter'],
+                    config=self._config)
+        else:
+            raise ClientError('unknown outbox write %s' % op)
+
+    def _replay_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    record = self._next()
+                    if record is not None:
+                        break
+                    self._cond.wait()
+                if self._closed:
+                    return
+            payload, size = record
+            write = orjson.loads(payload)
+            dropped = False
+            try:
+                self._apply(write)
+            except Exception as e:
+                if _is_transient(e):
+                    _logger.debug('replay of outbox %s failed: %s', self._directory, e)
+                    with self._cond:
+                        self._cond.wait(self._replay_interval)
+                    continue
+                _logger.warning('drop %s from outbox %s: %s', write['op'], self._directory, e)
+                dropped = True
+            rows = len(write.get('rows') or ()) or 1
+            with self._cond:
+                self._cursor = (self._cursor[0], self._cursor[1] + size)
+                self._save_cursor()
+                self._bytes -= size
+                self._records -= 1
+                if dropped:
+                    self._dropped += 1
+                else:
+                    self._replayed += 1
+                    self._replayed_rows += rows
+                    self._replay_history.append((time.time(), rows))
+                self._head_time = None
+                if self._records:
+                    following = self._next()
+                    if following is not None:
+                        self._head_time = orjson.loads(following[0]).get('time')
+                self._cond.notify_all()
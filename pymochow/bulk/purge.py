@@ -0,0 +1,168 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides a chunked and throttled delete of the rows matching a filter.
+"""
+import collections
+import logging
+import time
+from concurrent.futures import Future
+
+from pymochow.bulk.scan import _filter_literal, _select
+from pymochow.bulk.throttle import RateLimiter
+from pymochow.exception import ClientError
+from pymochow.model.enum import ReadConsistency
+
+_logger = logging.getLogger(__name__)
+
+DeleteProgress = collections.namedtuple('DeleteProgress',
+        ['scanned', 'deleted', 'failed', 'elapsed', 'rows_per_second', 'marker'])
+
+
+def _page_filter(filter, primary_key_fields, rows):
+    """
+    the filter of the matching rows of a page: with one primary key field its
+    key range, which a key ordered scan page covers, else its keys
+    """
+    if len(primary_key_fields) == 1:
+        name = primary_key_fields[0]
+        keys = [row[name] for row in rows]
+        return '(%s) AND %s >= %s AND %s <= %s' % (filter, name,
+                _filter_literal(min(keys)), name, _filter_literal(max(keys)))
+    keys = ' OR '.join('(%s)' % ' AND '.join('%s = %s' % (name, _filter_literal(row[name]))
+            for name in primary_key_fields) for row in rows)
+    return '(%s) AND (%s)' % (filter, keys)
+
+
+class FilterDeleter:
+    """
+    Delete the rows matching a filter without one huge delete request.
+
+    The primary keys of matching rows are found with select scans projected on
+    the key fields, batch_size rows per page, and every page is deleted with
+    one request whose filter is the filter narrowed to the page's primary key
+    range (or to its keys, for composite primary keys). Page deletes run on
+    the client's shared executor while the scan goes on, with at most
+    concurrency of them in flight and at most max_rows_per_second rows
+    deleted per second.
+
+    After every page, once it and the pages before it are deleted, progress
+    receives the counts so far and the marker to pass to run to resume after
+    that page. As deleted rows no longer match, running again from the start
+    after an interruption is correct too, the marker only saves rescanning.
+
+    Args:
+        table(Table): the table to delete from
+        filter(str): filter of the rows to delete
+        batch_size(int): rows per select and per delete
+        concurrency(Optional[int]): page deletes in flight, the size of the
+            shared executor by default
+        max_rows_per_second(Optional[float]): rate cap of deleted rows
+        primary_key_fields(Optional[List[str]]): primary key fields, found in
+            the table schema by default
+        progress(Optional[Callable[[DeleteProgress], None]]): called after every page
+        read_consistency(ReadConsistency): read consistency of the scans
+        config(Optional[Configuration]): client configuration
+    """
+
+    def __init__(self, table, filter, batch_size=1000, concurrency=None,
+            max_rows_per_second=None, primary_key_fields=None, progress=None,
+            read_consistency=ReadConsistency.EVENTUAL, config=None):
+        self._table = table
+        self._filter = filter
+        self._batch_size = batch_size
+        self._primary_key_fields = primary_key_fields or table._primary_key_fields()
+        if not self._primary_key_fields:
+            raise ClientError('primary_key_fields is required when the table schema is unknown')
+        executor = table.conn.executor
+        self._concurrency = concurrency or getattr(executor, '_max_workers', 1)
+        self._limiter = RateLimiter(max_rows_per_second) if max_rows_per_second else None
+        self._progress = progress
+        self._read_consistency = read_consistency
+        self._config = config
+        # (page filter, error) of the pages which failed to be deleted
+        self.failed_pages = []
+
+    def run(self, marker=None):
+        """
+        delete the matching rows
+        Args:
+            marker(Optional[dict]): marker to resume from, see DeleteProgress
+        Returns:
+            DeleteProgress: the final counts
+        """
+        table = self._table
+        executor = table.conn.executor
+        select = _select(table, self._filter, list(self._primary_key_fields),
+                self._batch_size, self._read_consistency, self._config)
+        counts = {'deleted': 0, 'failed': 0}
+        # (delete future, page filter, rows, rows scanned, next marker) in scan order
+        pending = collections.deque()
+        began = time.monotonic()
+        progress = DeleteProgress(0, 0, 0, 0.0, 0.0, marker)
+
+        def finish():
+            nonlocal progress
+            delete, page_filter, rows, scanned, next_marker = pending.popleft()
+            try:
+                delete.result()
+                counts['deleted'] += rows
+            except Exception as e:
+                _logger.debug('delete of %d rows failed: %s', rows, e)
+                counts['failed'] += rows
+                self.failed_pages.append((page_filter, e))
+            elapsed = time.monotonic() - began
+            progress = DeleteProgress(scanned, counts['deleted'], counts['failed'], elapsed,
+                    counts['deleted'] / elapsed if elapsed > 0 else 0.0, next_marker)
+            _logger.debug('deleted %d of %d rows scanned', progress.deleted, scanned)
+            if self._progress is not None:
+                self._progress(progress)
+
+        scanned = 0
+        future = executor.submit(select, marker=marker)
+        try:
+            while future is not None:
+                response = future.result()
+                future = None
+                next_marker = None
+                if getattr(response, 'is_truncated', False):
+                    next_marker = response.next_marker
+                    future = executor.submit(select, marker=next_marker)
+                rows = getattr(response, 'rows', None) or []
+                scanned += len(rows)
+                if not rows:
+                    pending.append((_completed(), None, 0, scanned, next_marker))
+                else:
+                    page_filter = _page_filter(self._filter, self._primary_key_fields, rows)
+                    if self._limiter is not None:
+                        self._limiter.acquire(len(rows))
+                    delete = executor.submit(table.delete, filter=page_filter,
+                            config=self._config)
+                    pending.append((delete, page_filter, len(rows), scanned, next_marker))
+                while pending and (len(pending) >= self._concurrency or pending[0][0].done()):
+                    finish()
+            while pending:
+                finish()
+        finally:
+            for delete in pending:
+                delete[0].cancel()
+            if future is not None:
+                future.cancel()
+        return progress
+
+
+def _completed():
+    """a future already done, standing for an empty page"""
+    future = Future()
+    future.set_result(None)
+    return future
@@ -0,0 +1,235 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides an alias based blue/green reindex of tables.
+"""
+import logging
+import time
+
+from pymochow.bulk.scan import scan, parallel_scan
+from pymochow.exception import BulkWriteError, ClientError, ServerError
+from pymochow.model.database import Database
+from pymochow.model.enum import TableState
+from pymochow.model.schema import Schema, VectorIndex
+from pymochow.model.table import Row
+
+_logger = logging.getLogger(__name__)
+
+STAGE_CREATE = 'create'
+STAGE_COPY = 'copy'
+STAGE_BUILD = 'build'
+STAGE_WARMUP = 'warmup'
+STAGE_SWITCH = 'switch'
+STAGE_DONE = 'done'
+
+
+class BlueGreenReindex:
+    """
+    Change the indexes of a live table without rebuilding them in place.
+
+    run creates a shadow table with the schema of the source table and the
+    given indexes, copies the rows with a scan (parallel with splits) feeding
+    one buffered writer (see Table.writer), rebuilds and waits for its vector
+    indexes to be NORMAL, calls warmup, then moves the aliases of the source
+    table to the shadow table. Clients reading through an alias switch to the
+    new indexes while the source table keeps serving until then.
+
+    Writes made during the reindex should go through upsert, insert and
+    delete of the orchestrator, which apply them to the source table and,
+    once created, to the shadow table. A row read by the copy before a
+    concurrent write and copied after it is stale in the shadow table;
+    pause writers or replay them if that window matters.
+
+    Args:
+        source(Table): the table to reindex
+        indexes(List[IndexField]): indexes of the shadow table, replacing the
+            source indexes of the same names
+        shadow_name(Optional[str]): name of the shadow table, the source name
+            with a _reindex suffix by default
+        splits(Optional[List[str]]): disjoint filters to copy in parallel
+        projections(Optional[List[str]]): fields to copy, every field of the
+            source schema by default
+        batch_size(int): rows per select and per upsert
+        concurrency(Optional[int]): splits copied and upserts sent at once,
+            the size of the shared executor by default
+        warmup(Optional[Callable[[Table], None]]): run against the shadow table
+            before the switch, e.g. a few representative searches
+        aliases(Optional[List[str]]): aliases to move, those of the source table
+            by default, which should then exist; with none the source table is
+            never dropped
+        drop_source(bool): drop the source table after the switch
+        index_timeout(float): seconds to wait for indexes to be built
+        poll_interval(float): seconds between checks of the shadow table creation
+        config(Optional[Configuration]): client configuration
+    """
+
+    def __init__(self, source, indexes, shadow_name=None, splits=None, projections=None,
+            batch_size=1000, concurrency=None, warmup=None, aliases=None, drop_source=False,
+            index_timeout=24 * 3600, poll_interval=5, config=None):
+        self._source = source
+        self._indexes = indexes
+        self._shadow_name = shadow_name or source.table_name + '_reindex'
+        self._splits = splits
+        self._projections = projections
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._warmup = warmup
+        self._aliases = aliases
+        self._drop_source = drop_source
+        self._index_timeout = index_timeout
+        self._poll_interval = poll_interval
+        self._config = config
+        self._database = Database(source.conn, source.database_name, source._config)
+        self._shadow = None
+        self.stage = None
+        self.rows_copied = 0
+
+    @property
+    def shadow(self):
+        """the shadow table, once created"""
+        return self._shadow
+
+    def upsert(self, rows):
+        """upsert rows into the source table and the shadow table"""
+        # rows may be an iterator, read once for both tables
+        rows = list(rows)
+        response = self._source.upsert(rows, config=self._config)
+        if self._shadow is not None:
+            self._shadow.upsert(rows, config=self._config)
+        return response
+
+    def insert(self, rows):
+        """insert rows into the source table, and upsert them into the shadow table"""
+        rows = list(rows)
+        response = self._source.insert(rows, config=self._config)
+        if self._shadow is not None:
+            self._shadow.upsert(rows, config=self._config)
+        return response
+
+    def delete(self, primary_key=None, partition_key=None, filter=None):
+        """delete rows from the source table and the shadow table"""
+        response = self._source.delete(primary_key=primary_key, partition_key=partition_key,
+                filter=filter, config=self._config)
+        if self._shadow is not None:
+            self._shadow.delete(primary_key=primary_key, partition_key=partition_key,
+                    filter=filter, config=self._config)
+        return response
+
+    def run(self):
+        """
+        reindex
+        Returns:
+            Table: the shadow table, now serving the aliases
+        Raises:
+            ClientError: the source table has no alias and aliases is not given
+        """
+        source = self._database.describe_table(self._source.table_name, config=self._config)
+        aliases = self._aliases if self._aliases is not None else source.aliases
+        if self._aliases is None and not aliases:
+            raise ClientError('table %s has no alias to move to the shadow table, pass '
+                    'aliases=[] to reindex without switching' % source.table_name)
+        self._set_stage(STAGE_CREATE)
+        self._shadow = self._create_shadow(source)
+        self._set_stage(STAGE_COPY)
+        self._copy(source)
+        self._set_stage(STAGE_BUILD)
+        self._build()
+        self._set_stage(STAGE_WARMUP)
+        if self._warmup is not None:
+            self._warmup(self._shadow)
+        self._set_stage(STAGE_SWITCH)
+        self._switch(source, aliases)
+        # without a switched alias the source table still serves by name
+        if self._drop_source and aliases:
+            self._database.drop_table(source.table_name, config=self._config)
+        self._set_stage(STAGE_DONE)
+        return self._shadow
+
+    def _set_stage(self, stage):
+        self.stage = stage
+        _logger.info('reindex of %s.%s: %s', self._source.database_name,
+                self._source.table_name, stage)
+
+    def _create_shadow(self, source):
+        indexes = {index.index_name: index for index in (source.schema.indexes or [])}
+        for index in self._indexes:
+            indexes[index.index_name] = index
+        schema = Schema(fields=source.schema.fields, indexes=list(indexes.values()))
+        self._database.create_table(self._shadow_name, source.replication, source.partition,
+                schema, enable_dynamic_field=source.enable_dynamic_field,
+                description=source.description, config=self._config)
+        deadline = time.monotonic() + self._index_timeout
+        while True:
+            shadow = self._database.describe_table(self._shadow_name, config=self._config)
+            if shadow.state == TableState.NORMAL:
+                return shadow
+            if time.monotonic() > deadline:
+                raise ClientError('timeout creating table %s' % self._shadow_name)
+            time.sleep(self._poll_interval)
+
+    def _copy(self, source):
+        projections = self._projections
+        if projections is None:
+            projections = [field.field_name for field in source.schema.fields]
+        concurrency = self._concurrency or getattr(self._shadow.conn.executor, '_max_workers', 1)
+        if self._splits is None:
+            pages = scan(self._source, projections=projections,
+                    batch_size=self._batch_size, config=self._config)
+        else:
+            pages = (page.rows for page in parallel_scan(self._source, self._splits,
+                    projections=projections, batch_size=self._batch_size,
+                    concurrency=self._concurrency, config=self._config))
+        # one writer for every page, so upserts overlap the scan
+        writer = self._shadow.writer(max_rows=self._batch_size, concurrency=concurrency,
+                config=self._config)
+        try:
+            for rows in pages:
+                writer.write_many(Row(**row) for row in rows)
+                self.rows_copied += len(rows)
+                _logger.debug('reindex copied %d rows', self.rows_copied)
+        except BaseException:
+            try:
+                writer.close()
+            except BulkWriteError as e:
+                _logger.debug('copy to %s failed: %s', self._shadow_name, e)
+            raise
+        try:
+            writer.close()
+        except BulkWriteError as e:
+            raise ClientError('copy to %s failed: %s'
+                    % (self._shadow_name, e.failures[0].error))
+
+    def _build(self):
+        names = [index.index_name for index in self._shadow.schema.indexes or []
+                if isinstance(index, VectorIndex)]
+        for name in names:
+            self._shadow.rebuild_index(name, config=self._config)
+        futures = [self._shadow.wait_for_index_async(name, timeout=self._index_timeout,
+                config=self._config) for name in names]
+        for future in futures:
+            future.result()
+
+    def _switch(self, source, aliases):
+        for alias in aliases:
+            try:
+                # servers moving an existing alias switch it atomically
+                self._shadow.alias(alias, config=self._config)
+                continue
+            except ServerError as e:
+                _logger.debug('alias %s not moved, unalias first: %s', alias, e)
+            source.unalias(alias, config=self._config)
+            try:
+                self._shadow.alias(alias, config=self._config)
+            except Exception:
+                source.alias(alias, config=self._config)
+                raise
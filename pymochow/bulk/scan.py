@@ -0,0 +1,171 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides sequential and parallel scans of table rows.
+"""
+import collections
+import functools
+import logging
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from pymochow.model.enum import ReadConsistency
+
+_logger = logging.getLogger(__name__)
+
+ScanPage = collections.namedtuple('ScanPage', ['split', 'rows', 'marker', 'done'])
+
+
+def _select(table, filter, projections, batch_size, read_consistency, config):
+    return functools.partial(table.select, filter=filter, projections=projections,
+            read_consistency=read_consistency, limit=batch_size, config=config)
+
+
+def scan(table, filter=None, projections=None, batch_size=1000,
+        read_consistency=ReadConsistency.EVENTUAL, marker=None, config=None):
+    """
+    iterate the pages of rows of a table with select, fetching the next page
+    on the client's shared executor while the current one is consumed
+    Args:
+        table(Table): the table to scan
+        filter(Optional[str]): filter of the rows
+        projections(Optional[List[str]]): fields to return
+        batch_size(int): rows per select
+        read_consistency(ReadConsistency): read consistency
+        marker(Optional[dict]): marker to resume from
+        config(Optional[Configuration]): client configuration
+    Returns:
+        Iterator[List[dict]]: pages of rows
+    """
+    select = _select(table, filter, projections, batch_size, read_consistency, config)
+    executor = table.conn.executor
+    future = executor.submit(select, marker=marker)
+    while future is not None:
+        response = future.result()
+        future = None
+        if getattr(response, 'is_truncated', False):
+            future = executor.submit(select, marker=response.next_marker)
+        yield getattr(response, 'rows', None) or []
+
+
+def split_points(field, points):
+    """
+    filters splitting the values of a field at the given points
+    Args:
+        field(str): the field, typically an integer primary key
+        points(List[Any]): increasing split points
+    Returns:
+        List[str]: len(points) + 1 disjoint filters covering all values
+    """
+    literals = [_filter_literal(point) for point in points]
+    if not literals:
+        return [None]
+    filters = ['%s < %s' % (field, literals[0])]
+    for low, high in zip(literals, literals[1:]):
+        filters.append('%s >= %s AND %s < %s' % (field, low, field, high))
+    filters.append('%s >= %s' % (field, literals[-1]))
+    return filters
+
+
+def split_range(field, start, end, splits):
+    """
+    filters splitting the integer range [start, end) of a field into equal ranges,
+    the first and last ones being open to cover values out of the range
+    Args:
+        field(str): the integer field
+        start(int): the expected lowest value
+        end(int): the expected highest value plus one
+        splits(int): number of filters
+    Returns:
+        List[str]: the filters
+    """
+    if splits <= 0 or end <= start:
+        raise ValueError('splits should be positive and start lower than end')
+    step = (end - start) / splits
+    points = sorted(set(start + int(step * i) for i in range(1, splits)))
+    return split_points(field, points)
+
+
+def _filter_literal(value):
+    """a value as a filter literal"""
+    if isinstance(value, str):
+        return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+    return str(value)
+
+
+def parallel_scan(table, splits, filter=None, projections=None, batch_size=1000,
+        concurrency=None, read_consistency=ReadConsistency.EVENTUAL, markers=None,
+        completed=None, config=None):
+    """
+    scan disjoint splits of a table concurrently, each split paging with its
+    own marker on the client's shared executor, and merge their pages into one
+    iterator. At most concurrency pages are in flight or waiting to be
+    consumed, so memory is bounded whatever the size of the table: the next
+    page of a split is fetched once its current page is consumed. Pages of a
+    split come in order; pages of different splits are interleaved.
+
+    To resume a scan, record the marker of the last page of each split and
+    the splits whose last page was done, and pass them as markers and
+    completed.
+    Args:
+        table(Table): the table to scan
+        splits(List[str]): disjoint filters covering the rows to scan, see
+            split_points and split_range
+        filter(Optional[str]): filter of the rows, combined with each split
+        projections(Optional[List[str]]): fields to return
+        batch_size(int): rows per select
+        concurrency(Optional[int]): splits scanned at once, the size of the
+            shared executor by default
+        read_consistency(ReadConsistency): read consistency
+        markers(Optional[Dict[int, dict]]): markers to resume splits from, by
+            split index, as returned in ScanPage.marker
+        completed(Optional[Set[int]]): indexes of the splits to skip, as
+            finished by a page whose done is True
+        config(Optional[Configuration]): client configuration
+    Returns:
+        Iterator[ScanPage]: pages with the index of their split, the marker to
+            resume the split after them and whether the split is done
+    """
+    executor = table.conn.executor
+    concurrency = concurrency or getattr(executor, '_max_workers', 1)
+    selects = []
+    for split in splits:
+        if filter is not None and split is not None:
+            split = '(%s) AND (%s)' % (filter, split)
+        elif split is None:
+            split = filter
+        selects.append(_select(table, split, projections, batch_size, read_consistency,
+            config))
+    markers = markers or {}
+    completed = completed or set()
+    waiting = collections.deque(index for index in range(len(selects))
+            if index not in completed)
+    active = {}
+    try:
+        while waiting or active:
+            while waiting and len(active) < concurrency:
+                index = waiting.popleft()
+                active[executor.submit(selects[index], marker=markers.get(index))] = index
+            done, _ = wait(active, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = active.pop(future)
+                response = future.result()
+                marker = None
+                if getattr(response, 'is_truncated', False):
+                    marker = response.next_marker
+                yield ScanPage(index, getattr(response, 'rows', None) or [], marker,
+                        marker is None)
+                if marker is not None:
+                    active[executor.submit(selects[index], marker=marker)] = index
+    finally:
+        for future in active:
+            future.cancel()
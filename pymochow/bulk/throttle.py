@@ -0,0 +1,66 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides a rate limiter for bulk operations.
+"""
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    A token bucket limiting operations to rate per second, allowing bursts of
+    burst operations after idle periods.
+
+    Args:
+        rate(float): operations per second
+        burst(Optional[float]): size of the bucket, one second of operations by default
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate should be positive')
+        self._lock = threading.Lock()
+        self._rate = float(rate)
+        self._burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self):
+        """operations per second"""
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        if rate <= 0:
+            raise ValueError('rate should be positive')
+        with self._lock:
+            self._refill()
+            self._rate = float(rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def acquire(self, n=1):
+        """wait until n operations are allowed"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= min(n, self._burst):
+                    self._tokens -= n
+                    return
+                delay = (min(n, self._burst) - self._tokens) / self._rate
+            time.sleep(delay)
@@ -0,0 +1,156 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides a concurrent, paced pipeline of row updates.
+"""
+import collections
+import logging
+import threading
+import time
+
+import orjson
+
+from pymochow.bulk.throttle import RateLimiter
+
+_logger = logging.getLogger(__name__)
+
+UpdateProgress = collections.namedtuple('UpdateProgress',
+        ['updated', 'folded', 'failed', 'elapsed', 'rows_per_second'])
+
+
+class BulkUpdater:
+    """
+    Apply many single row updates concurrently on the client's shared executor.
+
+    Updates are sent one key per request, as Table.update does, with at most
+    concurrency in flight. With adaptive, an AimdController observes every
+    update and paces the number in flight, backing off on 503s, timeouts and
+    latency jumps; max_rows_per_second caps the rate in any case.
+
+    With fold_window, the updates of a key met again within the last
+    fold_window pending updates are folded into one request, later fields
+    winning, so that a stream updating the same rows repeatedly sends each
+    row once. Updates of different keys may then be sent out of order.
+
+    Args:
+        table(Table): the table to update
+        concurrency(Optional[int]): updates in flight, the size of the shared
+            executor by default, capping the adaptive controller
+        max_rows_per_second(Optional[float]): rate cap of updates
+        adaptive(Optional[AimdController]): pace concurrency at runtime
+        fold_window(int): pending updates folded by key, 0 not to fold
+        progress(Optional[Callable[[UpdateProgress], None]]): called every
+            progress_interval finished updates
+        progress_interval(int): updates between progress calls
+        config(Optional[Configuration]): client configuration
+    """
+
+    def __init__(self, table, concurrency=None, max_rows_per_second=None, adaptive=None,
+            fold_window=1000, progress=None, progress_interval=1000, config=None):
+        self._table = table
+        executor = table.conn.executor
+        self._concurrency = concurrency or getattr(executor, '_max_workers', 1)
+        self._limiter = RateLimiter(max_rows_per_second) if max_rows_per_second else None
+        self._adaptive = adaptive
+        self._fold_window = fold_window
+        self._progress = progress
+        self._progress_interval = progress_interval
+        self._config = config
+        # (primary key, error) of the updates which failed
+        self.failed_keys = []
+
+    def run(self, updates):
+        """
+        apply updates
+        Args:
+            updates(Iterable[Tuple[dict, Optional[dict], dict]]): primary key,
+                partition key and update fields of each update
+        Returns:
+            UpdateProgress: the final counts and throughput
+        """
+        executor = self._table.conn.executor
+        cond = threading.Condition()
+        counts = {'updated': 0, 'failed': 0, 'folded': 0, 'inflight': 0}
+        began = time.monotonic()
+
+        def snapshot():
+            elapsed = time.monotonic() - began
+            return UpdateProgress(counts['updated'], counts['folded'], counts['failed'],
+                    elapsed, counts['updated'] / elapsed if elapsed > 0 else 0.0)
+
+        def done(primary_key, sent, future):
+            error = future.exception()
+            if self._adaptive is not None:
+                self._adaptive.observe(1, time.monotonic() - sent, error)
+            with cond:
+                if error is None:
+                    counts['updated'] += 1
+                else:
+                    _logger.debug('update of %s failed: %s', primary_key, error)
+                    counts['failed'] += 1
+                    self.failed_keys.append((primary_key, error))
+                counts['inflight'] -= 1
+                finished = counts['updated'] + counts['failed']
+                report = finished % self._progress_interval == 0
+                progress = snapshot() if report else None
+                cond.notify_all()
+            if progress is not None:
+                _logger.debug('updated %d rows, %.1f rows/s', progress.updated,
+                        progress.rows_per_second)
+                if self._progress is not None:
+                    self._progress(progress)
+
+        def send(primary_key, partition_key, update_fields):
+            if self._limiter is not None:
+                self._limiter.acquire()
+            with cond:
+                while counts['inflight'] >= self._limit():
+                    cond.wait()
+                counts['inflight'] += 1
+            sent = time.monotonic()
+            try:
+                future = executor.submit(self._table.update, primary_key=primary_key,
+                        partition_key=partition_key, update_fields=update_fields,
+                        config=self._config)
+            except Exception:
+                with cond:
+                    counts['inflight'] -= 1
+                raise
+            future.add_done_callback(lambda f: done(primary_key, sent, f))
+
+        pending = collections.OrderedDict()
+        try:
+            for primary_key, partition_key, update_fields in updates:
+                if self._fold_window <= 0:
+                    send(primary_key, partition_key, update_fields)
+                    continue
+                key = orjson.dumps(primary_key, option=orjson.OPT_SORT_KEYS)
+                if key in pending:
+                    pending[key][2].update(update_fields)
+                    counts['folded'] += 1
+                    continue
+                pending[key] = (primary_key, partition_key, dict(update_fields))
+                if len(pending) > self._fold_window:
+                    send(*pending.popitem(last=False)[1])
+            while pending:
+                send(*pending.popitem(last=False)[1])
+        finally:
+            with cond:
+                while counts['inflight']:
+                    cond.wait()
+        return snapshot()
+
+    def _limit(self):
+        if self._adaptive is None:
+            return self._concurrency
+        return min(self._adaptive.concurrency, self._concurrency)
@@ -0,0 +1,416 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides bulk writers for tables.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+
+import orjson
+
+from pymochow.bulk.ingest import IngestResult, ChunkFailure
+from pymochow.exception import BulkWriteError, ClientError
+from pymochow.model.table import _fan_out
+
+_logger = logging.getLogger(__name__)
+
+
+def _partition_group(partition_field, partition_num=None, partition_hash=None):
+    """the function mapping a row to its group, see group_rows_by_partition"""
+    if partition_hash is not None and partition_num:
+        def group(row):
+            return partition_hash(row.to_dict().get(partition_field)) % partition_num
+    else:
+        def group(row):
+            return orjson.dumps(row.to_dict().get(partition_field), option=orjson.OPT_SORT_KEYS)
+    return group
+
+
+def group_rows_by_partition(rows, partition_field, partition_num=None, partition_hash=None):
+    """
+    order rows so that rows of the same partition are adjacent.
+
+    With partition_hash, the function the server uses to map a partition key
+    value to an int, rows are grouped by partition_hash(value) % partition_num,
+    i.e. by server partition. Without it rows are grouped by partition key
+    value, as rows sharing a value always share a partition. The order of rows
+    within a group is kept.
+    Args:
+        rows(List[Row]): rows to group
+        partition_field(str): name of the partition key field
+        partition_num(Optional[int]): number of partitions of the table
+        partition_hash(Optional[Callable[[Any], int]]): partition function of the server
+    Returns:
+        List[Row]: the grouped rows
+    """
+    return sorted(rows, key=_partition_group(partition_field, partition_num, partition_hash))
+
+
+def _batch_end(bounds, start, end, size, strict):
+    """
+    end of the batch of at most size rows starting at start, rows [start, end)
+    being left. bounds are the sorted positions where a partition group ends.
+    Strict batches hold one group; otherwise whole groups are packed, and a
+    group larger than size is split.
+    """
+    limit = min(start + size, end)
+    if strict:
+        i = bisect.bisect_right(bounds, start)
+        return min(bounds[i], limit) if i < len(bounds) else limit
+    i = bisect.bisect_right(bounds, limit) - 1
+    return bounds[i] if i >= 0 and bounds[i] > start else limit
+
+
+class BulkWriter:
+    """
+    Write many rows with batched insert/upsert requests sent concurrently on
+    the executor shared by the table's client.
+
+    By default rows are grouped by partition key before they are cut into
+    batches (see group_rows_by_partition), and batches are cut at group
+    boundaries, so each batch touches few partitions and the server handles
+    more of it locally. With partition_hash every batch holds the rows of one
+    server partition. Without it the server partition of a key is unknown:
+    whole groups of equal keys are packed into batches instead, which only
+    helps when many rows share a partition key value, and a unique partition
+    key gives plain batch_size batches.
+
+    Args:
+        table(Table): the table to write
+        batch_size(int): rows per request
+        concurrency(Optional[int]): maximum requests in flight, the size of the
+            shared executor by default
+        upsert(bool): upsert rows, or insert them when False
+        group_by_partition(bool): group rows by partition key before batching,
+            needs the table schema
+        partition_hash(Optional[Callable[[Any], int]]): partition function of the
+            server, see group_rows_by_partition
+        config(Optional[Configuration]): client configuration
+        adaptive(Optional[AimdController]): tune batch size and concurrency at
+            runtime, batch_size being ignored and concurrency capping the
+            controller
+    """
+
+    def __init__(self, table, batch_size=500, concurrency=None, upsert=True,
+            group_by_partition=True, partition_hash=None, config=None, adaptive=None):
+        if batch_size <= 0:
+            raise ValueError('batch_size should be a positive integer')
+        self._table = table
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._upsert = upsert
+        self._group_by_partition = group_by_partition
+        self._partition_hash = partition_hash
+        self._config = config
+        self._adaptive = adaptive
+
+    def batches(self, rows):
+        """
+        cut rows into the batches write would send, without adaptive
+        Returns:
+            List[List[Row]]: batches in sending order
+        """
+        rows, bounds, strict = self._ordered(rows)
+        return [rows[start:end] for start, end in
+                self._spans([(0, len(rows))], bounds, strict, self._batch_size)]
+
+    def _ordered(self, rows):
+        """
+        the rows in sending order, the positions where their partition groups
+        end, and whether a batch should hold a single group
+        """
+        rows = list(rows)
+        partition_field = self._table._partition_key_field()
+        if not self._group_by_partition or partition_field is None:
+            return rows, [], False
+        partition = self._table.partition
+        partition_num = partition.partition_num if partition is not None else None
+        group = _partition_group(partition_field, partition_num, self._partition_hash)
+        keyed = sorted(((group(row), row) for row in rows), key=lambda item: item[0])
+        bounds = [i for i in range(1, len(keyed)) if keyed[i][0] != keyed[i - 1][0]]
+        bounds.append(len(keyed))
+        strict = self._partition_hash is not None and bool(partition_num)
+        return [row for _, row in keyed], bounds, strict
+
+    @staticmethod
+    def _spans(ranges, bounds, strict, size):
+        """cut row ranges into batches, see _batch_end"""
+        for start, end in ranges:
+            while start < end:
+                stop = _batch_end(bounds, start, end, size, strict)
+                yield start, stop
+                start = stop
+
+    def write(self, rows, journal=None):
+        """
+        write rows
+        Args:
+            rows(Iterable[Row]): rows to write
+            journal(Optional[CheckpointJournal]): skip the rows it records as
+                committed and record the batches written, positions being
+                positions in the sending order, which is the same for the same rows
+        Returns:
+            IngestResult: rows written and failed batches, start and end of a
+                failure being positions in the sending order
+        """
+        rows, bounds, strict = self._ordered(rows)
+        result = IngestResult()
+        ranges = journal.pending(len(rows)) if journal is not None else [(0, len(rows))]
+        result.add_skipped(len(rows) - sum(end - start for start, end in ranges))
+        if self._adaptive is not None:
+            return self._write_adaptive(rows, bounds, strict, ranges, result, journal)
+        chunks = list(self._spans(ranges, bounds, strict, self._batch_size))
+        futures = _fan_out(self._table.conn.executor,
+                lambda chunk: self._write_batch(rows[chunk[0]:chunk[1]]),
+                chunks, self._concurrency)
+        for (start, end), future in zip(chunks, futures):
+            error = future.exception()
+            if error is None:
+                result.add_success(end - start)
+                if journal is not None:
+                    journal.record(start, end)
+            else:
+                _logger.debug('bulk write of rows [%d, %d) failed: %s', start, end, error)
+                result.add_failure(start, end, error, rows[start:end])
+        return result
+
+    def _write_adaptive(self, rows, bounds, strict, ranges, result, journal):
+        """write rows in batches sized and paced by the adaptive controller"""
+        controller = self._adaptive
+        executor = self._table.conn.executor
+        cond = threading.Condition()
+        inflight = [0]
+
+        def done(start, batch, began, future):
+            error = future.exception()
+            controller.observe(len(batch), time.monotonic() - began, error)
+            with cond:
+                if error is None:
+                    result.add_success(len(batch))
+                    if journal is not None:
+                        journal.record(start, start + len(batch))
+                else:
+                    _logger.debug('bulk write of rows [%d, %d) failed: %s',
+                            start, start + len(batch), error)
+                    result.add_failure(start, start + len(batch), error, batch)
+                inflight[0] -= 1
+                cond.notify_all()
+
+        for start, end in ranges:
+            while start < end:
+                with cond:
+                    while inflight[0] >= min(controller.concurrency,
+                            self._concurrency or controller.concurrency):
+                        cond.wait()
+                    inflight[0] += 1
+                batch = rows[start:_batch_end(bounds, start, end, controller.batch_size,
+                        strict)]
+                began = time.monotonic()
+                try:
+                    future = executor.submit(self._write_batch, batch)
+                except Exception as e:
+                    with cond:
+                        inflight[0] -= 1
+                        result.add_failure(start, end, e, rows[start:end])
+                    start = end
+                    continue
+                future.add_done_callback(functools.partial(done, start, batch, began))
+                start += len(batch)
+        with cond:
+            while inflight[0]:
+                cond.wait()
+        return result
+
+    def _write_batch(self, batch):
+        if self._upsert:
+            return self._table.upsert(batch, config=self._config)
+        return self._table.insert(batch, config=self._config)
+
+
+class BufferedWriter:
+    """
+    Buffer rows written one at a time and send them in batches.
+
+    A batch is flushed in the background as soon as the buffer holds max_rows
+    rows or max_bytes bytes of encoded rows, or its oldest row has waited
+    linger_ms. At most concurrency batches are in flight; write blocks while
+    all of them are busy. Errors of background flushes are raised, as a
+    BulkWriteError listing the failed rows, by the next flush or close, which
+    wait for every outstanding row to be delivered or reported. Use it as a
+    context manager, see Table.writer.
+
+    Args:
+        table(Table): the table to write
+        max_rows(int): rows per batch
+        max_bytes(int): encoded bytes per batch
+        linger_ms(int): longest time a row is buffered
+        concurrency(int): maximum batches in flight
+        upsert(bool): upsert rows, or insert them when False
+        config(Optional[Configuration]): client configuration
+    """
+
+    def __init__(self, table, max_rows=500, max_bytes=4 * 1024 * 1024, linger_ms=100,
+            concurrency=4, upsert=True, config=None):
+        if max_rows <= 0 or max_bytes <= 0:
+            raise ValueError('max_rows and max_bytes should be positive integers')
+        if concurrency <= 0:
+            raise ValueError('concurrency should be a positive integer')
+        self._table = table
+        self._max_rows = max_rows
+        self._max_bytes = max_bytes
+        self._linger = linger_ms / 1000.0
+        self._upsert = upsert
+        self._config = config
+
+        self._cond = threading.Condition()
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffer_since = None
+        # index of the first buffered row among all rows written
+        self._buffer_start = 0
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._inflight = set()
+        self._failures = []
+        self._closed = False
+        self._linger_thread = threading.Thread(target=self._linger_loop,
+                name='pymochow-writer', daemon=True)
+        self._linger_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # keep the error of the with body, only logging rows which failed
+        try:
+            self.close()
+        except BulkWriteError as e:
+            _logger.warning('%s while handling %r', e, exc_value)
+
+    def write(self, row):
+        """buffer a row, blocking while concurrency batches are in flight"""
+        size = len(orjson.dumps(row.to_dict()))
+        with self._cond:
+            if self._closed:
+                raise ClientError('writer is closed')
+            self._buffer.append(row)
+            self._buffer_bytes += size
+            if self._buffer_since is None:
+                self._buffer_since = time.monotonic()
+                self._cond.notify_all()
+            batch = None
+            if len(self._buffer) >= self._max_rows or self._buffer_bytes >= self._max_bytes:
+                batch = self._take()
+        if batch is not None:
+            self._submit(*batch)
+
+    def write_many(self, rows):
+        """buffer rows"""
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        """
+        send the buffered rows and wait for every batch in flight
+        Raises:
+            BulkWriteError: rows failed since the last flush
+        """
+        with self._cond:
+            batch = self._take()
+        if batch is not None:
+            self._submit(*batch)
+        with self._cond:
+            while self._inflight:
+                self._cond.wait()
+            failures, self._failures = self._failures, []
+        if failures:
+            rows = sum(failure.end - failure.start for failure in failures)
+            raise BulkWriteError('%d rows failed to be written' % rows,
+                    sorted(failures, key=lambda f: f.start))
+
+    def close(self):
+        """
+        flush and stop the writer
+        Raises:
+            BulkWriteError: rows failed since the last flush
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._linger_thread.join()
+        self.flush()
+
+    def _take(self):
+        """
+        take the buffered rows, with the lock held. The batch counts as in
+        flight from now on, so flush waits for it while it waits for a slot.
+        """
+        if not self._buffer:
+            return None
+        batch = (self._buffer_start, self._buffer)
+        self._inflight.add(self._buffer_start)
+        self._buffer_start += len(self._buffer)
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffer_since = None
+        return batch
+
+    def _submit(self, start, rows):
+        """send a batch in the background"""
+        self._slots.acquire()
+        try:
+            future = self._table.conn.executor.submit(self._send, rows)
+        except Exception as e:
+            self._done(start, rows, e)
+            return
+        future.add_done_callback(lambda f: self._done(start, rows, f.exception()))
+
+    def _send(self, rows):
+        if self._upsert:
+            return self._table.upsert(rows, config=self._config)
+        return self._table.insert(rows, config=self._config)
+
+    def _done(self, start, rows, error):
+        with self._cond:
+            if error is not None:
+                _logger.debug('buffered write of rows [%d, %d) failed: %s',
+                        start, start + len(rows), error)
+                self._failures.append(ChunkFailure(start, start + len(rows), error, rows))
+            self._inflight.discard(start)
+            self._cond.notify_all()
+        self._slots.release()
+
+    def _linger_loop(self):
+        """flush buffers whose oldest row waited linger_ms"""
+        while True:
+            with self._cond:
+                batch = None
+                while batch is None and not self._closed:
+                    if self._buffer_since is None:
+                        self._cond.wait()
+                        continue
+                    remaining = self._buffer_since + self._linger - time.monotonic()
+                    if remaining > 0:
+                        self._cond.wait(remaining)
+                        continue
+                    batch = self._take()
+                if batch is None:
+                    return
+            self._submit(*batch)
@@ -0,0 +1,180 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module defines a cache of rows queried by primary key.
+"""
+
+import collections
+import threading
+import time
+
+import orjson
+
+
+class RowCache(object):
+    """An LRU cache with TTL of Table.query responses.
+
+    Set it as Configuration.row_cache to enable it. Entries are keyed by
+    (database, table, primary key, partition key, projections, retrieve vector)
+    and dropped when rows with the same primary key are written through the
+    same client. Queries with ReadConsistency.STRONG bypass the cache.
+
+    Cached responses are shared by all callers and should be treated as read only.
+    """
+
+    def __init__(self, max_size=10000, ttl_in_mills=60 * 1000, negative_ttl_in_mills=None):
+        """
+        :param max_size: the maximum number of cached queries.
+        :type max_size: int
+        :param ttl_in_mills: how long a row stays cached in milliseconds.
+        :type ttl_in_mills: int
+        :param negative_ttl_in_mills: how long a ROW_KEY_NOT_FOUND error stays cached
+            in milliseconds, not cached when None.
+        :type negative_ttl_in_mills: int
+        :raise ValueError if max_size is not positive.
+        """
+        if max_size <= 0:
+            raise ValueError('max_size should be a positive integer.')
+
+        self.max_size = max_size
+        self.ttl_in_mills = ttl_in_mills
+        self.negative_ttl_in_mills = negative_ttl_in_mills
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        # (database, table, primary key) -> keys of the cached queries of the row
+        self._rows = {}
+        # invalidations are numbered; a query records the number when sent and
+        # its response is not cached if its row, its table or the whole cache
+        # was invalidated since
+        self._generation = 0
+        # (database, table, primary key) -> [queries in flight, last invalidation]
+        # of the rows being queried only, so that it stays bounded
+        self._pending = {}
+        # (database, table) -> last invalidation of the table
+        self._tables = {}
+        self._cleared = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # a cache is sent to other processes empty, with its settings only
+        return {'max_size': self.max_size, 'ttl_in_mills': self.ttl_in_mills,
+                'negative_ttl_in_mills': self.negative_ttl_in_mills}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @staticmethod
+    def make_key(database, table, primary_key, partition_key, projections, retrieve_vector):
+        """the cache key of a query"""
+        return (database, table, _canonical(primary_key), _canonical(partition_key),
+                _canonical(projections), bool(retrieve_vector))
+
+    def generation(self, key):
+        """
+        the token of a query about to be sent, to pass to put, or to release
+        when the query fails without a response to cache
+        """
+        with self._lock:
+            pending = self._pending.setdefault(key[:3], [0, 0])
+            pending[0] += 1
+            return key[:3], self._generation
+
+    def release(self, generation):
+        """forget the token of a query whose response is not put"""
+        with self._lock:
+            self._release(generation)
+
+    def get(self, key):
+        """
+        :return: tuple of (hit, response, error)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expire_at, response, error = entry
+                if expire_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, response, error
+                self._remove(key)
+            self.misses += 1
+            return False, None, None
+
+    def put(self, key, generation, response=None, error=None):
+        """
+        cache the response of a query, or the ROW_KEY_NOT_FOUND error it raised.
+        Nothing is cached if the row or its table was invalidated since
+        generation was taken, as the response may predate that write.
+        """
+        ttl_in_mills = self.ttl_in_mills if error is None else self.negative_ttl_in_mills
+        with self._lock:
+            if self._release(generation) or ttl_in_mills is None:
+                return
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl_in_mills / 1000.0, response, error)
+            self._rows.setdefault(key[:3], set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, database, table, primary_key):
+        """drop the cached queries of a row"""
+        row = (database, table, _canonical(primary_key))
+        with self._lock:
+            self._generation += 1
+            pending = self._pending.get(row)
+            if pending is not None:
+                pending[1] = self._generation
+            for key in self._rows.pop(row, ()):
+                self._entries.pop(key, None)
+
+    def invalidate_table(self, database, table):
+        """drop the cached queries of every row of a table"""
+        with self._lock:
+            self._generation += 1
+            self._tables[(database, table)] = self._generation
+            for row in [row for row in self._rows if row[:2] == (database, table)]:
+                for key in self._rows.pop(row):
+                    self._entries.pop(key, None)
+
+    def clear(self):
+        """drop every cached query"""
+        with self._lock:
+            self._generation += 1
+            self._cleared = self._generation
+            self._entries.clear()
+            self._rows.clear()
+
+    def _release(self, generation):
+        """forget a query token, returning whether its row was invalidated since"""
+        row, taken = generation
+        pending = self._pending.get(row)
+        invalidated = self._cleared
+        if pending is not None:
+            invalidated = max(invalidated, pending[1])
+            pending[0] -= 1
+            if pending[0] <= 0:
+                del self._pending[row]
+        return max(invalidated, self._tables.get(row[:2], 0)) > taken
+
+    def _remove(self, key):
+        if self._entries.pop(key, None) is not None:
+            keys = self._rows.get(key[:3])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._rows[key[:3]]
+
+
+def _canonical(value):
+    return orjson.dumps(value, option=orjson.OPT_SORT_KEYS) if value is not None else None
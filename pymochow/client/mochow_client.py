@@ -30,13 +30,17 @@ _logger = logging.getLogger(__name__)
 class MochowClient:
     """
     mochow sdk client
+
+    A client is thread safe: threads may share one client and the Database
+    and Table objects it returns, all of them sending through one shared
+    connection pool.
     """
 
     def __init__(self, config=None, adapter: HTTPAdapter=None):
         self._config = copy.deepcopy(configuration.DEFAULT_CONFIG)
         if config is not None:
             self._config.merge_non_none_values(config)
-        self._conn = HTTPClient(config, adapter)
+        self._conn = HTTPClient(self._config, adapter)
     
     def _merge_config(self, config):
         """merge config
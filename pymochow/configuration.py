@@ -38,7 +38,13 @@ class Configuration(object):
                  backup_endpoint=None,
                  proxy_host=None,
                  proxy_port=None,
-                 uri_prefix=None):
+                 uri_prefix=None,
+                 max_idle_time_in_mills=None,
+                 compression=None,
+                 compression_threshold=None,
+                 max_connections=None,
+                 row_cache=None,
+                 singleflight=None):
         """初始化方法，用于创建 Client 实例。
         
         Args:
@@ -54,6 +60,12 @@ class Configuration(object):
             proxy_host (str): http/https 代理主机地址。
             proxy_port (int): http/https 代理端口号。
             uri_prefix(str): appbuilder的gateway的uri前缀
+            max_idle_time_in_mills (int): 连接池中空闲连接的最长复用时间，单位为毫秒，超过后在复用前关闭并重建（默认值：50000ms）。
+            compression (str): 请求体压缩算法，可选 "gzip" 或 "zstd"（需安装 zstandard），默认不压缩。
+            compression_threshold (int): 请求体大于等于该字节数时才压缩（默认值：64KB）。
+            max_connections (int): 每个服务端点可保持的最大空闲连接数，所有线程共享（默认值：10）。
+            row_cache (:class:`pymochow.cache.row_cache.RowCache`): 按主键查询的行缓存，默认不缓存。
+            singleflight (:class:`pymochow.http.singleflight.SingleFlight`): 合并并发的相同读请求，默认不合并。
         
         """
         self.credentials = credentials
@@ -72,6 +84,12 @@ class Configuration(object):
         self.backup_endpoint = compat.convert_to_bytes(backup_endpoint) \
                 if backup_endpoint is not None else backup_endpoint
         self.uri_prefix = uri_prefix
+        self.max_idle_time_in_mills = max_idle_time_in_mills
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.max_connections = max_connections
+        self.row_cache = row_cache
+        self.singleflight = singleflight
 
     def merge_non_none_values(self, other):
         """
@@ -88,9 +106,15 @@ DEFAULT_PROTOCOL = pymochow.protocol.HTTP
 DEFAULT_CONNECTION_TIMEOUT_IN_MILLIS = 50 * 1000
 DEFAULT_SEND_BUF_SIZE = 1024 * 1024
 DEFAULT_RECV_BUF_SIZE = 10 * 1024 * 1024
+DEFAULT_MAX_IDLE_TIME_IN_MILLIS = 50 * 1000
+DEFAULT_COMPRESSION_THRESHOLD = 64 * 1024
+DEFAULT_MAX_CONNECTIONS = 10
 DEFAULT_CONFIG = Configuration(
     protocol=DEFAULT_PROTOCOL,
     connection_timeout_in_mills=DEFAULT_CONNECTION_TIMEOUT_IN_MILLIS,
     send_buf_size=DEFAULT_SEND_BUF_SIZE,
     recv_buf_size=DEFAULT_RECV_BUF_SIZE,
+    max_idle_time_in_mills=DEFAULT_MAX_IDLE_TIME_IN_MILLIS,
+    compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+    max_connections=DEFAULT_MAX_CONNECTIONS,
     retry_policy=BackOffRetryPolicy())
@@ -47,6 +47,18 @@ class ClientError(Error):
         Error.__init__(self, message)
 
 
+class BulkWriteError(ClientError):
+    """Error reporting the rows a bulk write failed to deliver."""
+    def __init__(self, message, failures):
+        """
+        Args:
+            message (str): 错误信息。
+            failures (List[ChunkFailure]): 写入失败的行区间及其错误。
+        """
+        ClientError.__init__(self, message)
+        self.failures = failures
+
+
 class ServerError(Error):
     """Error from mochow servers."""
     REQUEST_EXPIRED = b'RequestExpired'
@@ -16,18 +16,31 @@ This module provide http request function for bce services.
 from future.utils import iteritems, iterkeys, itervalues
 from builtins import str, bytes
 import logging
+import os
 import sys
+import threading
 import time
 import traceback
-import platform
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import gzip
 import requests
 from requests.adapters import HTTPAdapter
 from requests.adapters import PoolManager
 import socket
 from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util import make_headers
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 import pymochow
 from pymochow import compat
+from pymochow import configuration
 from pymochow import utils
 from pymochow.http.http_response import HttpResponse
 from pymochow.exception import HttpClientError
@@ -39,44 +52,350 @@ from pymochow.auth import bce_v1_signer
 
 _logger = logging.getLogger(__name__)
 
+_TCP_KEEPIDLE_IN_SECONDS = 120
+_TCP_KEEPINTVL_IN_SECONDS = 10
+_TCP_KEEPCNT = 3
+
+_GZIP_COMPRESS_LEVEL = 1
+_ZSTD_COMPRESS_LEVEL = 3
+
+
+class _IdleAwarePoolMixin(object):
+    """
+    Connection pool mixin which remembers when each connection was returned to
+    the pool, and closes connections idle longer than max_idle_time (seconds)
+    before they are reused. A closed connection reconnects on its next request.
+    """
+    max_idle_time = None
+
+    def _get_conn(self, timeout=None):
+        conn = super(_IdleAwarePoolMixin, self)._get_conn(timeout=timeout)
+        last_used = getattr(conn, '_mochow_last_used', None)
+        if self.max_idle_time is not None and last_used is not None \
+                and time.monotonic() - last_used > self.max_idle_time:
+            _logger.debug('Closing connection idle for more than %ss: %s',
+                    self.max_idle_time, self.host)
+            conn.close()
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn._mochow_last_used = time.monotonic()
+        super(_IdleAwarePoolMixin, self)._put_conn(conn)
+
+
+class _IdleAwareHTTPConnectionPool(_IdleAwarePoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _IdleAwareHTTPSConnectionPool(_IdleAwarePoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _IdleAwarePoolManager(PoolManager):
+    """pool manager creating idle aware connection pools"""
+
+    def __init__(self, max_idle_time=None, **kwargs):
+        super(_IdleAwarePoolManager, self).__init__(**kwargs)
+        self.max_idle_time = max_idle_time
+        self.pool_classes_by_scheme = {
+            'http': _IdleAwareHTTPConnectionPool,
+            'https': _IdleAwareHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super(_IdleAwarePoolManager, self)._new_pool(
+                scheme, host, port, request_context=request_context)
+        pool.max_idle_time = self.max_idle_time
+        return pool
+
 
 class _SockOpsAdapter(HTTPAdapter):
-    def __init__(self, options, **kwargs):
+    __attrs__ = HTTPAdapter.__attrs__ + ['options', 'max_idle_time']
+
+    def __init__(self, options, max_idle_time=None, **kwargs):
         self.options = options
+        self.max_idle_time = max_idle_time
         super(_SockOpsAdapter, self).__init__(**kwargs)
 
     def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
         """init connection pool"""
-        self.poolmanager = PoolManager(num_pools=connections,
+        self.poolmanager = _IdleAwarePoolManager(num_pools=connections,
                                        maxsize=maxsize,
                                        block=block,
-                                       socket_options=self.options)
+                                       socket_options=self.options,
+                                       max_idle_time=self.max_idle_time)
+
+
+def _socket_options(config=None):
+    """
+    Build the socket options applied to every pooled connection: TCP_NODELAY,
+    TCP keepalive and, when configured, the send/recv buffer sizes. Options not
+    available on the running platform are skipped.
+    """
+    options = list(HTTPConnection.default_socket_options)
+    if (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) not in options:
+        options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, _TCP_KEEPIDLE_IN_SECONDS))
+    elif hasattr(socket, 'TCP_KEEPALIVE'):
+        # macOS names the keepalive idle time TCP_KEEPALIVE
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, _TCP_KEEPIDLE_IN_SECONDS))
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, _TCP_KEEPINTVL_IN_SECONDS))
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, _TCP_KEEPCNT))
+    if config is not None:
+        if config.send_buf_size:
+            options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, config.send_buf_size))
+        if config.recv_buf_size:
+            options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, config.recv_buf_size))
+    return options
+
+
+def _is_stale_connection_error(error):
+    """
+    Whether the error means the connection was closed by the peer (server or
+    proxy), typically a pooled keep-alive socket closed while idle. The request
+    may or may not have reached the server, so it is only resent when the
+    retry policy allows it, but without waiting as a fresh connection is used.
+    """
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    seen = set()
+    pending = [error]
+    while pending:
+        e = pending.pop()
+        if id(e) in seen:
+            continue
+        seen.add(id(e))
+        if isinstance(e, (http.client.RemoteDisconnected,
+                          ConnectionResetError, BrokenPipeError)):
+            return True
+        for arg in getattr(e, 'args', ()):
+            if isinstance(arg, BaseException):
+                pending.append(arg)
+        for cause in (e.__cause__, e.__context__):
+            if cause is not None:
+                pending.append(cause)
+    return False
+
+
+_MAX_REQUEST_TEMPLATES = 64
+
+_canonical_time_cache = (None, None)
+
+
+def _get_canonical_time():
+    """canonical time of now, formatted at most once per second"""
+    global _canonical_time_cache
+    now = int(time.time())
+    second, canonical_time = _canonical_time_cache
+    if second != now:
+        canonical_time = utils.get_canonical_time(now)
+        _canonical_time_cache = (now, canonical_time)
+    return canonical_time
+
+
+# row operations which only read, so that identical concurrent ones can share a response
+_READ_OPERATIONS = frozenset([b'query', b'search', b'batchSearch', b'select'])
+
+
+def _is_read_request(path, params):
+    """whether the request is a row read"""
+    return bool(params) and path is not None and path.endswith(b'/row') \
+            and any(k in _READ_OPERATIONS for k in params)
+
+
+def _is_stream(body):
+    """whether the body is an iterator of chunks, sent with chunked transfer encoding"""
+    return hasattr(body, '__next__') and hasattr(body, '__iter__')
+
+
+def _compress_body(body, compression):
+    """
+    compress the request body
+    :param body: request body
+    :type body: bytes
+    :param compression: "gzip" or "zstd"
+    :type compression: str
+    :return: tuple of the compressed body and its Content-Encoding
+    """
+    compression = compat.convert_to_string(compression).lower()
+    if compression == 'gzip':
+        return gzip.compress(body, compresslevel=_GZIP_COMPRESS_LEVEL), b'gzip'
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ClientError('zstd compression requires the zstandard package')
+        return zstandard.ZstdCompressor(level=_ZSTD_COMPRESS_LEVEL).compress(body), b'zstd'
+    raise ClientError('Unsupported compression: %s' % compression)
+
+
+def _credentials_key(credentials):
+    """
+    identify credentials by object and by value, so that credentials rotated in
+    place (api_key and appbuilder_token are public attributes) are signed anew
+    """
+    return (id(credentials), getattr(credentials, 'account', None),
+            getattr(credentials, 'api_key', None),
+            getattr(credentials, 'appbuilder_token', None))
+
+
+class _RequestTemplate(object):
+    """
+    The request independent part of a request: the User-Agent and Host headers,
+    the parsed endpoint and the signed authorization headers. It is built once per
+    (endpoint, credentials, sign function), so sign_function must not depend on
+    the method, path or params of the request.
+    """
+
+    def __init__(self, config, sign_function):
+        self.credentials = config.credentials
+        self.endpoint = config.endpoint
+        self.uri_prefix = config.uri_prefix
+
+        protocol, host, port = utils.parse_host_port(config.endpoint, config.protocol)
+        if port != config.protocol.default_port:
+            host += b':' + compat.convert_to_bytes(port)
+
+        user_agent = 'pymochow/%s/%s/%s' % (
+            compat.convert_to_string(pymochow.SDK_VERSION), sys.version, sys.platform)
+        self.headers = {
+            http_headers.USER_AGENT: compat.convert_to_bytes(user_agent.replace('\n', '')),
+            http_headers.HOST: host,
+            # only advertise the encodings urllib3 is able to decode
+            http_headers.ACCEPT_ENCODING: compat.convert_to_bytes(
+                make_headers(accept_encoding=True)['accept-encoding']),
+        }
+        self.headers.update(sign_function(config.credentials, None, None, self.headers, None))
+
+
+# http clients of this process by client id, to reuse them when unpickled
+_http_clients = weakref.WeakValueDictionary()
+# clients unpickled from another process are kept alive, so that the handles sent
+# to a worker process task after task keep reusing one connection pool
+_restored_http_clients = {}
+
+
+def _restore_http_client(client_id, adapter):
+    """unpickle an HTTPClient, reusing the one of this process with the same id"""
+    http_client = _http_clients.get(client_id)
+    if http_client is None:
+        http_client = HTTPClient.__new__(HTTPClient)
+        http_client._adapter = adapter
+        http_client._init_state(client_id)
+        _restored_http_clients[client_id] = http_client
+    return http_client
 
 
 class HTTPClient:
-    """http client"""
+    """
+    http client
+
+    An HTTPClient may be shared by any number of threads. All threads send
+    through one shared HTTPAdapter, i.e. one thread safe urllib3 connection
+    pool, while each thread gets its own requests.Session on first use, since
+    requests does not guarantee a Session to be thread safe.
+
+    The client is fork safe: a forked child process detects that it does not
+    own the pool and rebuilds it instead of sharing sockets with its parent.
+    The client can also be pickled; unpickling it in a process which already
+    has the same client returns that client, so Database and Table handles are
+    cheap to send to worker processes.
+    """
 
     def __init__(self, config, adapter: HTTPAdapter = None):
         """create http client"""
-        self.session = requests.Session()
-        self._set_adapter(adapter)
-    
-    def _set_adapter(self, adapter: HTTPAdapter = None):
+        self._set_adapter(adapter, config)
+        self._init_state(uuid.uuid4().hex)
+
+    def _init_state(self, client_id):
+        """init the per process state of the client"""
+        self._client_id = client_id
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._request_templates = {}
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        _http_clients[client_id] = self
+
+    def __reduce__(self):
+        return (_restore_http_client, (self._client_id, self._adapter))
+
+    def _reset_after_fork(self):
+        """drop the connection pool and sessions inherited from the parent process"""
+        _logger.debug('Fork detected, rebuilding connection pool in process %d', os.getpid())
+        adapter = self._adapter
+        adapter.proxy_manager = {}
+        adapter.init_poolmanager(adapter._pool_connections, adapter._pool_maxsize,
+                block=adapter._pool_block)
+        self._pid = os.getpid()
+        self._local = threading.local()
+        # threads of the parent's executor do not exist in the child
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _set_adapter(self, adapter: HTTPAdapter = None, config=None):
         """set http adapter"""
         if not adapter:
-            if 'linux' not in platform.platform().lower():
-                return
-            options = HTTPConnection.default_socket_options + [
-                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
-                (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 120),
-                (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10),
-                (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3),
-            ]
+            max_idle_time = None
+            if config is not None and config.max_idle_time_in_mills is not None:
+                max_idle_time = config.max_idle_time_in_mills / 1000.0
+            max_connections = configuration.DEFAULT_MAX_CONNECTIONS
+            if config is not None and config.max_connections is not None:
+                max_connections = config.max_connections
             adapter = _SockOpsAdapter(pool_connections=10,
-                                      pool_maxsize=10, max_retries=3, options=options)
-        self.session.mount('http://', adapter)
-        self.session.mount('https://', adapter)
+                                      pool_maxsize=max_connections, max_retries=3,
+                                      options=_socket_options(config),
+                                      max_idle_time=max_idle_time)
+        self._adapter = adapter
+
+    @property
+    def session(self):
+        """the requests session of the calling thread, mounted on the shared adapter"""
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            self._local.session = session
+        return session
     
+    @property
+    def executor(self):
+        """
+        the thread pool shared by the concurrent operations of this client, sized
+        as the connection pool of an endpoint
+        """
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                            max_workers=self._adapter._pool_maxsize,
+                            thread_name_prefix='pymochow')
+        return self._executor
+
+    def _get_request_template(self, config, sign_function):
+        """
+        get the prepared request template of the config's endpoint and credentials,
+        building and caching it on first use
+        """
+        key = (config.endpoint, config.protocol.name, config.uri_prefix,
+                _credentials_key(config.credentials), sign_function)
+        template = self._request_templates.get(key)
+        if template is None or template.credentials is not config.credentials:
+            template = _RequestTemplate(config, sign_function)
+            self.check_headers(template.headers)
+            if len(self._request_templates) >= _MAX_REQUEST_TEMPLATES:
+                self._request_templates.clear()
+            self._request_templates[key] = template
+        return template
+
     def check_headers(self, headers):
         """
         check value in headers, if \n in value, raise
@@ -117,6 +436,14 @@ class HTTPClient:
             body_parser = handler.parse_json
        
         try:
+            if config.singleflight is not None and _is_read_request(path, params) \
+                    and isinstance(body, bytes) and not headers:
+                key = (config.endpoint, _credentials_key(config.credentials), path,
+                        tuple(sorted(params.items())), body, body_parser)
+                return config.singleflight.do(key, lambda: self._send_request(
+                        config, bce_v1_signer.sign,
+                        [handler.parse_error, body_parser],
+                        http_method, path, body, headers, params))
             return self._send_request(
                     config, bce_v1_signer.sign, 
                     [handler.parse_error, body_parser],
@@ -146,70 +473,55 @@ class HTTPClient:
         """
         _logger.debug(b'%s request start: %s %s, %s',
                       http_method, path, headers, params)
-        headers = headers or {}
+        template = self._get_request_template(config, sign_function)
 
-        user_agent = 'pymochow/%s/%s/%s' % (
-            compat.convert_to_string(pymochow.SDK_VERSION), sys.version, sys.platform)
-        user_agent = user_agent.replace('\n', '')
-        user_agent = compat.convert_to_bytes(user_agent)
-        headers[http_headers.USER_AGENT] = user_agent
-     
-        should_get_new_date = False
-        if http_headers.DATE not in headers:
-            should_get_new_date = True
-
-        request_endpoint = config.endpoint
-
-        headers[http_headers.HOST] = request_endpoint
+        should_get_new_date = headers is None or http_headers.DATE not in headers
+        if headers:
+            self.check_headers(headers)
+            headers = dict(headers)
+            headers.update(template.headers)
+        else:
+            headers = dict(template.headers)
 
         if isinstance(body, str):
             body = body.encode(pymochow.DEFAULT_ENCODING)
+        if config.compression and isinstance(body, bytes) \
+                and len(body) >= (config.compression_threshold or 0):
+            body, content_encoding = _compress_body(body, config.compression)
+            headers[http_headers.CONTENT_ENCODING] = content_encoding
         if not body:
             headers[http_headers.CONTENT_LENGTH] = '0'
         elif isinstance(body, bytes):
             headers[http_headers.CONTENT_LENGTH] = str(len(body))
-        elif http_headers.CONTENT_LENGTH not in headers:
+        elif http_headers.CONTENT_LENGTH not in headers and not _is_stream(body):
             raise ValueError(b'No %s is specified.' % http_headers.CONTENT_LENGTH)
         # store the offset of fp body
         offset = None
         if hasattr(body, "tell") and hasattr(body, "seek"):
             offset = body.tell()
+        # an iterator body is sent chunked and can not be replayed
+        one_shot = offset is None and _is_stream(body)
 
-        protocol, host, port = utils.parse_host_port(request_endpoint, config.protocol)
-        
-        if config.uri_prefix is not None:
-            path = utils.append_uri(config.uri_prefix, path)
-        
-        url = request_endpoint + path
-        
-        headers[http_headers.HOST] = host
-        if port != config.protocol.default_port:
-            headers[http_headers.HOST] += b':' + compat.convert_to_bytes(port)
-
-        sign_headers = sign_function(
-            config.credentials, http_method, path, headers, params)
-        headers.update(sign_headers)
-        
-        encoded_params = utils.get_canonical_querystring(params, False)
-        if len(encoded_params) > 0:
-            uri = path + b'?' + encoded_params
-        else:
-            uri = path
-        self.check_headers(headers)
+        if template.uri_prefix is not None:
+            path = utils.append_uri(template.uri_prefix, path)
+        url = template.endpoint + path
 
         retries_attempted = 0
+        stale_connection_retried = False
+        resend = False
         errors = []
         while True:
             try:
                 # restore the offset of fp body when retrying
                 if should_get_new_date is True:
-                    headers[http_headers.DATE] = utils.get_canonical_time()
+                    headers[http_headers.DATE] = _get_canonical_time()
 
-                _logger.debug('request args:method=%s, uri=%s, headers=%s, patams=%s, body=%s',
-                        http_method, uri, headers, params, body)
+                _logger.debug('request args:method=%s, path=%s, headers=%s, patams=%s, body=%s',
+                        http_method, path, headers, params, body)
 
-                if retries_attempted > 0 and offset is not None:
+                if resend and offset is not None:
                     body.seek(offset)
+                resend = True
                 if http_method == http_methods.POST:
                     http_response = self.session.post(url, data=body,
                             params=params,
@@ -239,25 +551,34 @@ class HTTPClient:
                         temp_heads.append((k, v))
                     headers_list = temp_heads
 
-                _logger.debug(
-                    'request return: status=%d, headers=%s' %
-                    (http_response.status_code, headers_list))
+                _logger.debug('request return: status=%d, headers=%s',
+                        http_response.status_code, headers_list)
                 response = HttpResponse()
                 response.set_metadata_from_headers(dict(headers_list))
 
                 for handler_function in response_handler_functions:
                     if handler_function(http_response, response):
                         break
-                _logger.debug('response:%s' % (response))
+                _logger.debug('response:%s', response)
                 return response
             except Exception as e:
                 # insert ">>>>" before all trace back lines and then save it
                 errors.append('\n'.join('>>>>' + line for line in traceback.format_exc().splitlines()))
 
+                if one_shot:
+                    _logger.debug('Unable to resend a streamed body, giving up.')
+                    raise e
+
                 if config.retry_policy.should_retry(e, retries_attempted):
-                    delay_in_millis = config.retry_policy.get_delay_before_next_retry_in_millis(
-                        e, retries_attempted)
-                    time.sleep(delay_in_millis / 1000.0)
+                    # a reused keep-alive socket closed by the peer while idle, resend
+                    # on a fresh connection without waiting
+                    if not stale_connection_retried and _is_stale_connection_error(e):
+                        _logger.debug('Connection closed by peer, resend on a new connection.')
+                        stale_connection_retried = True
+                    else:
+                        delay_in_millis = config.retry_policy.get_delay_before_next_retry_in_millis(
+                            e, retries_attempted)
+                        time.sleep(delay_in_millis / 1000.0)
                 else:
                     _logger.debug('Unable to execute HTTP request. Retried %d times. '
                             'All trace backs:\n%s' % (retries_attempted,
@@ -271,5 +592,8 @@ class HTTPClient:
         
 
     def close(self):
-        """close session"""
-        self.session.close()
+        """close the shared connection pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._adapter.close()
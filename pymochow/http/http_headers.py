@@ -16,6 +16,8 @@ This module defines string constants for HTTP headers
 
 # Standard HTTP Headers
 
+ACCEPT_ENCODING = b"Accept-Encoding"
+
 AUTHORIZATION = b"Authorization"
 
 APPBUILDER_AUTHORIZATION = b"X-Appbuilder-Authorization"
@@ -13,6 +13,7 @@
 """
 This module provides a general response class for mochow services.
 """
+import functools
 from future.utils import iteritems
 from builtins import str
 from builtins import bytes
@@ -21,6 +22,15 @@ from pymochow import compat
 from pymochow.http import http_headers
 
 
+@functools.lru_cache(maxsize=256)
+def _metadata_name(header_name):
+    """convert a response header name into its metadata attribute name"""
+    k = header_name
+    if k.startswith(compat.convert_to_string(http_headers.BCE_PREFIX)):
+        k = 'bce_' + k[len(compat.convert_to_string(http_headers.BCE_PREFIX)):]
+    return utils.pythonize_name(k.replace('-', '_'))
+
+
 class HttpResponse(object):
     """
     
@@ -45,9 +55,7 @@ class HttpResponse(object):
         :return:
         """
         for k, v in iteritems(headers):
-            if k.startswith(compat.convert_to_string(http_headers.BCE_PREFIX)):
-                k = 'bce_' + k[len(compat.convert_to_string(http_headers.BCE_PREFIX)):]
-            k = utils.pythonize_name(k.replace('-', '_'))
+            k = _metadata_name(k)
             if k.lower() == compat.convert_to_string(http_headers.ETAG.lower()):
                 v = v.strip('"')
             setattr(self.metadata, k, v)
@@ -0,0 +1,83 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides de-duplication of identical in-flight requests.
+"""
+
+import threading
+
+
+class _Call(object):
+    """an in-flight call and its outcome"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Collapse identical concurrent calls into one.
+
+    Set it as Configuration.singleflight to collapse identical read requests
+    (query, search, batch search and select with the same body) sent
+    concurrently through the client: the first one goes to the server and the
+    others wait for it and share its response, or its error. Shared responses
+    should be treated as read only.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.collapsed = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # in-flight calls belong to this process
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def do(self, key, fn):
+        """
+        call fn, unless a call with the same key is in flight, in which case wait
+        for it and return its result or raise its error
+        :param key: hashable identity of the call
+        :param fn: the call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,204 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides a manager building indexes of many tables with bounded concurrency.
+"""
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import CancelledError, Future, wait
+
+from pymochow.index.waiter import default_waiter
+from pymochow.model.schema import VectorIndex
+
+_logger = logging.getLogger(__name__)
+
+TASK_QUEUED = 'queued'
+TASK_BUILDING = 'building'
+TASK_NORMAL = 'normal'
+TASK_FAILED = 'failed'
+
+IndexTask = collections.namedtuple('IndexTask',
+        ['database', 'table', 'index', 'state', 'started', 'finished', 'error'])
+
+
+def _once(function):
+    """
+    a function calling function the first time only, later calls returning
+    its result or raising its error again
+    """
+    lock = threading.Lock()
+    outcome = []
+
+    def call():
+        with lock:
+            if not outcome:
+                try:
+                    outcome.append((function(), None))
+                except Exception as e:
+                    outcome.append((None, e))
+        result, error = outcome[0]
+        if error is not None:
+            raise error
+        return result
+    return call
+
+
+class IndexManager:
+    """
+    Rebuild or create indexes of many tables with at most
+    max_concurrent_builds builds running, the others waiting in order.
+
+    Every change of state of an index is passed to on_progress, and on_ready
+    is called once an index is NORMAL. status lists the state of all the
+    indexes submitted. Cancelling a returned future before its build starts
+    takes it out of the queue.
+
+    Args:
+        max_concurrent_builds(int): builds running at once
+        timeout(Optional[float]): seconds a build may take before failing
+        on_ready(Optional[Callable[[IndexTask], None]]): called when an index is NORMAL
+        on_progress(Optional[Callable[[IndexTask], None]]): called on every change
+        waiter(Optional[IndexWaiter]): the waiter polling indexes, the shared one
+            by default
+        config(Optional[Configuration]): client configuration
+    """
+
+    def __init__(self, max_concurrent_builds=2, timeout=None, on_ready=None, on_progress=None,
+            waiter=None, config=None):
+        if max_concurrent_builds <= 0:
+            raise ValueError('max_concurrent_builds should be a positive integer')
+        self._max_concurrent_builds = max_concurrent_builds
+        self._timeout = timeout
+        self._on_ready = on_ready
+        self._on_progress = on_progress
+        self._waiter = waiter or default_waiter()
+        self._config = config
+        self._lock = threading.Lock()
+        self._queue = collections.deque()
+        self._running = 0
+        self._tasks = collections.OrderedDict()
+        self._futures = []
+
+    def rebuild(self, table, index_name):
+        """
+        rebuild an index
+        Returns:
+            Future: of the index description once NORMAL
+        """
+        return self._submit(table, index_name,
+                lambda: table.rebuild_index(index_name, config=self._config))
+
+    def create(self, table, indexes):
+        """
+        create indexes of a table, waiting for the vector ones to be built.
+        The indexes are created when the first of their vector indexes
+        starts, so within max_concurrent_builds; without vector indexes they
+        are created at once.
+        Args:
+            table(Table): the table
+            indexes(List[IndexField]): the indexes
+        Returns:
+            List[Future]: of each vector index description once NORMAL
+        """
+        names = [index.index_name for index in indexes if isinstance(index, VectorIndex)]
+        if not names:
+            table.create_indexes(indexes, config=self._config)
+            return []
+        start = _once(lambda: table.create_indexes(indexes, config=self._config))
+        return [self._submit(table, name, start) for name in names]
+
+    def status(self):
+        """
+        Returns:
+            List[IndexTask]: the indexes submitted, in order
+        """
+        with self._lock:
+            return list(self._tasks.values())
+
+    def wait(self, timeout=None):
+        """
+        wait for all the indexes submitted
+        Returns:
+            bool: whether they are all done
+        """
+        with self._lock:
+            futures = list(self._futures)
+        _, not_done = wait(futures, timeout)
+        return not not_done
+
+    def _submit(self, table, index_name, start):
+        key = (table.database_name, table.table_name, index_name)
+        future = Future()
+        with self._lock:
+            self._futures.append(future)
+            self._queue.append((key, table, start, future))
+        self._update(key, TASK_QUEUED)
+        self._launch()
+        return future
+
+    def _update(self, key, state, error=None):
+        with self._lock:
+            task = self._tasks.get(key)
+            started = task.started if task is not None else None
+            if state == TASK_BUILDING:
+                started = time.time()
+            finished = time.time() if state in (TASK_NORMAL, TASK_FAILED) else None
+            task = IndexTask(key[0], key[1], key[2], state, started, finished, error)
+            self._tasks[key] = task
+        _logger.debug('index %s.%s.%s %s', key[0], key[1], key[2], state)
+        for callback in (self._on_progress,
+                self._on_ready if state == TASK_NORMAL else None):
+            if callback is not None:
+                try:
+                    callback(task)
+                except Exception:
+                    _logger.exception('index callback failed')
+
+    def _launch(self):
+        while True:
+            with self._lock:
+                if self._running >= self._max_concurrent_builds or not self._queue:
+                    return
+                key, table, start, future = self._queue.popleft()
+                cancelled = not future.set_running_or_notify_cancel()
+                if not cancelled:
+                    self._running += 1
+            if cancelled:
+                self._update(key, TASK_FAILED, CancelledError())
+                continue
+            self._update(key, TASK_BUILDING)
+            try:
+                if start is not None:
+                    start()
+                waited = self._waiter.wait_async(table, key[2], timeout=self._timeout,
+                        config=self._config)
+            except Exception as e:
+                self._done(key, future, None, e)
+                continue
+            waited.add_done_callback(
+                    lambda f, key=key, future=future: self._done(key, future, f.result()
+                        if f.exception() is None else None, f.exception()))
+
+    def _done(self, key, future, index, error):
+        with self._lock:
+            self._running -= 1
+        if error is None:
+            self._update(key, TASK_NORMAL)
+            future.set_result(index)
+        else:
+            _logger.debug('build of index %s failed: %s', key, error)
+            self._update(key, TASK_FAILED, error)
+            future.set_exception(error)
+        self._launch()
@@ -0,0 +1,150 @@
+# Copyright 2023 Baidu, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the
+# License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""
+This module provides a waiter of index builds polling many indexes from one thread.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from pymochow.exception import ClientError, HttpClientError
+from pymochow.model.enum import IndexState
+
+_logger = logging.getLogger(__name__)
+
+
+class _Watch:
+    """an index waited for"""
+
+    def __init__(self, table, index_name, deadline, interval, config):
+        self.table = table
+        self.index_name = index_name
+        self.deadline = deadline
+        self.interval = interval
+        self.config = config
+        self.future = Future()
+
+
+class IndexWaiter:
+    """
+    Wait for indexes to reach IndexState.NORMAL without a thread per index.
+
+    One scheduler thread keeps the indexes waited for by their next poll time
+    and sends each describe_index on the client's shared executor when due.
+    Polls start initial_interval apart and back off by backoff up to
+    max_interval, so short builds are seen quickly and long ones cost few
+    requests. IO errors of a poll are retried at the next poll.
+
+    Args:
+        initial_interval(float): seconds before the first poll
+        max_interval(float): longest seconds between polls
+        backoff(float): growth of the interval after every poll
+    """
+
+    def __init__(self, initial_interval=0.5, max_interval=30.0, backoff=1.5):
+        self._initial_interval = initial_interval
+        self._max_interval = max_interval
+        self._backoff = backoff
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._thread = None
+        self._pid = None
+
+    def wait_async(self, table, index_name, timeout=None, config=None):
+        """
+        wait for an index to be built
+        Args:
+            table(Table): the table of the index
+            index_name(str): the index name
+            timeout(Optional[float]): seconds before failing with ClientError
+            config(Optional[Configuration]): client configuration
+        Returns:
+            Future: of the index description once NORMAL, cancellable
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        watch = _Watch(table, index_name, deadline, self._initial_interval, config)
+        self._schedule(watch, self._initial_interval)
+        return watch.future
+
+    def _schedule(self, watch, delay):
+        with self._cond:
+            if self._thread is None or self._pid != os.getpid():
+                # the scheduler thread does not survive a fork
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run,
+                        name='pymochow-index-waiter', daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), watch))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, watch = heapq.heappop(self._heap)
+            if watch.future.cancelled():
+                continue
+            try:
+                watch.table.conn.executor.submit(self._poll, watch)
+            except Exception as e:
+                self._finish(watch, error=e)
+
+    def _poll(self, watch):
+        try:
+            index = watch.table.describe_index(watch.index_name, config=watch.config)
+        except (IOError, HttpClientError) as e:
+            _logger.debug('poll of index %s failed: %s', watch.index_name, e)
+            index = None
+        except Exception as e:
+            self._finish(watch, error=e)
+            return
+        if index is not None and getattr(index, 'state', IndexState.NORMAL) == IndexState.NORMAL:
+            self._finish(watch, result=index)
+            return
+        if watch.deadline is not None and time.monotonic() >= watch.deadline:
+            self._finish(watch, error=ClientError('timeout waiting for index %s of %s.%s'
+                    % (watch.index_name, watch.table.database_name, watch.table.table_name)))
+            return
+        watch.interval = min(watch.interval * self._backoff, self._max_interval)
+        delay = watch.interval
+        if watch.deadline is not None:
+            delay = min(delay, max(watch.deadline - time.monotonic(), 0))
+        self._schedule(watch, delay)
+
+    @staticmethod
+    def _finish(watch, result=None, error=None):
+        if not watch.future.set_running_or_notify_cancel():
+            return
+        if error is not None:
+            watch.future.set_exception(error)
+        else:
+            watch.future.set_result(result)
+
+
+_default_waiter = None
+_default_waiter_lock = threading.Lock()
+
+
+def default_waiter():
+    """the waiter shared by Table.wait_for_index"""
+    global _default_waiter
+    with _default_waiter_lock:
+        if _default_waiter is None:
+            _default_waiter = IndexWaiter()
+        return _default_waiter
@@ -13,7 +13,9 @@
 """
 This module provide table model.
 """
+import collections
 import copy
+from concurrent.futures import CancelledError, Future
 import orjson
 from pymochow import utils
 from pymochow import client
@@ -26,9 +28,11 @@ from pymochow.model.schema import (
     DefaultAutoBuildPolicy,
     AutoBuildTool,
 )
-from pymochow.model.enum import PartitionType, ReadConsistency
+from pymochow.model.enum import PartitionType, ReadConsistency, ServerErrCode
 from pymochow.model.enum import IndexType, IndexState, MetricType, AutoBuildPolicyType
-from pymochow.exception import ClientError
+from pymochow.exception import ClientError, ServerError
+
+_STREAM_CHUNK_SIZE = 256 * 1024
 
 class Partition:
     """
@@ -38,6 +42,16 @@ class Partition:
         self._partition_num = partition_num
         self._partition_type = partition_type
 
+    @property
+    def partition_num(self):
+        """partition num"""
+        return self._partition_num
+
+    @property
+    def partition_type(self):
+        """partition type"""
+        return self._partition_type
+
     def to_dict(self):
         """to dict"""
         res = {
@@ -161,54 +175,222 @@ class Table:
             new_config.merge_non_none_values(config)
             return new_config
 
-    def insert(self, rows, config=None):
+    def _stream_rows_body(self, rows, chunk_size=_STREAM_CHUNK_SIZE):
+        """
+        encode the rows body incrementally, yielding chunks of about chunk_size bytes
+        """
+        head = orjson.dumps({"database": self.database_name, "table": self.table_name})
+        chunk = bytearray(head[:-1])
+        chunk += b',"rows":['
+        first = True
+        for row in rows:
+            if not first:
+                chunk += b','
+            first = False
+            chunk += orjson.dumps(row.to_dict())
+            if len(chunk) >= chunk_size:
+                yield bytes(chunk)
+                chunk.clear()
+        chunk += b']}'
+        yield bytes(chunk)
+
+    def insert(self, rows, config=None, stream=False):
         """
         insert rows
+        Args:
+            rows(Iterable[Row]): rows to insert
+            config(Optional[Configuration]): client configuration
+            stream(bool): encode rows lazily while sending them with chunked
+                transfer encoding, rows may be any iterable such as a generator.
+                A streamed request is not retried.
         """
         if not self.conn:
             raise ClientError('conn is closed')
 
-        body = {}
-        body["database"] = self.database_name
-        body["table"] = self.table_name
-        body["rows"] = []
+        if stream:
+            json_body = self._stream_rows_body(rows)
+        else:
+            body = {}
+            body["database"] = self.database_name
+            body["table"] = self.table_name
+            body["rows"] = []
 
-        for row in rows:
-            body['rows'].append(row.to_dict())
-        json_body = orjson.dumps(body)
+            for row in rows:
+                body['rows'].append(row.to_dict())
+            json_body = orjson.dumps(body)
 
         config = self._merge_config(config)
         uri = utils.append_uri(client.URL_PREFIX, client.URL_VERSION, 'row')
 
-        return self.conn.send_request(http_methods.POST,
-                path=uri,
-                body=json_body,
-                params={b'insert': b''},
-                config=config)
+        try:
+            return self.conn.send_request(http_methods.POST,
+                    path=uri,
+                    body=json_body,
+                    params={b'insert': b''},
+                    config=config)
+        finally:
+            self._invalidate_rows(config, None if stream else body["rows"])
 
-    def upsert(self, rows, config=None):
+    def upsert(self, rows, config=None, stream=False):
         """
         upsert rows
+        Args:
+            rows(Iterable[Row]): rows to upsert
+            config(Optional[Configuration]): client configuration
+            stream(bool): encode rows lazily while sending them with chunked
+                transfer encoding, rows may be any iterable such as a generator.
+                A streamed request is not retried.
         """
         if not self.conn:
             raise ClientError('conn is closed')
 
-        body = {}
-        body["database"] = self.database_name
-        body["table"] = self.table_name
-        body["rows"] = []
+        if stream:
+            json_body = self._stream_rows_body(rows)
+        else:
+            body = {}
+            body["database"] = self.database_name
+            body["table"] = self.table_name
+            body["rows"] = []
 
-        for row in rows:
-            body['rows'].append(row.to_dict())
-        json_body = orjson.dumps(body)
+            for row in rows:
+                body['rows'].append(row.to_dict())
+            json_body = orjson.dumps(body)
 
         config = self._merge_config(config)
         uri = utils.append_uri(client.URL_PREFIX, client.URL_VERSION, 'row')
 
-        return self.conn.send_request(http_methods.POST,
-                path=uri,
-                body=json_body,
-                params={b'upsert': b''},
+        try:
+            return self.conn.send_request(http_methods.POST,
+                    path=uri,
+                    body=json_body,
+                    params={b'upsert': b''},
+                    config=config)
+        finally:
+            self._invalidate_rows(config, None if stream else body["rows"])
+
+    def writer(self, max_rows=500, max_bytes=4 * 1024 * 1024, linger_ms=100,
+            concurrency=4, upsert=True, config=None):
+        """
+        get a writer buffering rows written one at a time and sending them in
+        background batches, to use as a context manager:
+
+            with table.writer(max_rows=1000, linger_ms=50) as writer:
+                for row in rows:
+                    writer.write(row)
+
+        Exiting the context waits until every row is written and raises a
+        BulkWriteError for the rows which failed, or only logs it when the
+        with body raised, so that its error propagates.
+        Args:
+            max_rows(int): rows per batch
+            max_bytes(int): encoded bytes per batch
+            linger_ms(int): longest time a row is buffered
+            concurrency(int): maximum batches in flight, writes block beyond
+            upsert(bool): upsert rows, or insert them when False
+            config(Optional[Configuration]): client configuration
+        Returns:
+            BufferedWriter: the writer
+        """
+        if not self.conn:
+            raise ClientError('conn is closed')
+        from pymochow.bulk.writer import BufferedWriter
+        return BufferedWriter(self, max_rows=max_rows, max_bytes=max_bytes,
+                linger_ms=linger_ms, concurrency=concurrency, upsert=upsert, config=config)
+
+    def import_from(self, vectors, metadata=None, vector_field=None, id_field=None,
+            chunk_size=500, concurrency=None, upsert=True, journal=None, config=None,
+            processes=None):
+        """
+        import a vector matrix and its row metadata with bounded memory, see
+        pymochow.bulk.importer.Importer
+        Args:
+            vectors: path of a float32 .npy file (memory-mapped), or a 2-d
+                matrix such as a numpy memmap
+            metadata: path of a .parquet (needs pyarrow) or .jsonl file, or an
+                iterable of dicts, aligned with vectors
+            vector_field(Optional[str]): name of the vector field, found in the
+                schema by default
+            id_field(Optional[str]): field set to the row position
+            chunk_size(int): rows per request
+            concurrency(Optional[int]): chunks in flight
+            upsert(bool): upsert rows, or insert them when False
+            journal(Optional[CheckpointJournal]): resume from the chunks it records
+            config(Optional[Configuration]): client configuration
+            processes(Optional[int]): build and send chunks from that many worker
+                processes instead of threads, vectors being a .npy path
+        Returns:
+            IngestResult: rows written and failed chunks
+        """
+        if not self.conn:
+            raise ClientError('conn is closed')
+        from pymochow.bulk.importer import Importer
+        return Importer(self, vector_field=vector_field, id_field=id_field,
+                chunk_size=chunk_size, concurrency=concurrency, upsert=upsert,
+                config=config, processes=processes).run(vectors, metadata, journal)
+
+    def export(self, path, format='parquet', projections=None, filter=None,
+            vector_field=None, batch_size=1000, progress=None,
+            read_consistency=ReadConsistency.EVENTUAL, config=None, splits=None,
+            concurrency=None):
+        """
+        export rows to files, see pymochow.bulk.export.Exporter
+        Args:
+            path(str): the parquet file, or the path of the .npy and .jsonl files
+                without extension
+            format(str): parquet (needs pyarrow) or npy+jsonl
+            projections(Optional[List[str]]): fields to export, every field of the schema by default
+            filter(Optional[str]): filter of the rows to export
+            vector_field(Optional[str]): name of the vector field, found in the
+                schema by default
+            batch_size(int): rows per select
+            progress(Optional[Callable[[ExportProgress], None]]): called after every page
+            read_consistency(ReadConsistency): read consistency
+            config(Optional[Configuration]): client configuration
+            splits(Optional[List[str]]): disjoint filters scanned in parallel,
+                see parallel_select
+            concurrency(Optional[int]): splits scanned at once
+        Returns:
+            ExportProgress: rows exported, seconds taken and throughput
+        """
+        if not self.conn:
+            raise ClientError('conn is closed')
+        from pymochow.bulk.export import Exporter
+        return Exporter(self, format=format, projections=projections, filter=filter,
+                vector_field=vector_field, batch_size=batch_size, progress=progress,
+                read_consistency=read_consistency, config=config, splits=splits,
+                concurrency=concurrency).run(path)
+
+    def parallel_select(self, splits, filter=None, projections=None, batch_size=1000,
+            concurrency=None, read_consistency=ReadConsistency.EVENTUAL, markers=None,
+            completed=None, config=None):
+        """
+        select the rows of disjoint splits of the table concurrently, each with
+        its own marker, merged into one iterator with bounded buffering, see
+        pymochow.bulk.scan.parallel_scan:
+
+            from pymochow.bulk.scan import split_range
+            for page in table.parallel_select(split_range('id', 0, 10000000, 16)):
+                handle(page.rows)
+        Args:
+            splits(List[str]): disjoint filters covering the rows to select
+            filter(Optional[str]): filter of the rows, combined with each split
+            projections(Optional[List[str]]): fields to return
+            batch_size(int): rows per select
+            concurrency(Optional[int]): splits selected at once
+            read_consistency(ReadConsistency): read consistency
+            markers(Optional[Dict[int, dict]]): markers to resume splits from
+            completed(Optional[Set[int]]): splits to skip, already done
+            config(Optional[Configuration]): client configuration
+        Returns:
+            Iterator[ScanPage]: pages with their split index, resume marker and
+                whether the split is done
+        """
+        if not self.conn:
+            raise ClientError('conn is closed')
+        from pymochow.bulk.scan import parallel_scan
+        return parallel_scan(self, splits, filter=filter, projections=projections,
+                batch_size=batch_size, concurrency=concurrency,
+                read_consistency=read_consistency, markers=markers, completed=completed,
                 config=config)
 
     def query(self, primary_key, partition_key=None, projections=None,
@@ -235,11 +417,36 @@ class Table:
         config = self._merge_config(config)
         uri = utils.append_uri(client.URL_PREFIX, client.URL_VERSION, 'row')
 
-        return self.conn.send_request(http_methods.POST,
-                path=uri,
-                body=json_body,
-                params={b'query': b''},
-                config=config)
+        row_cache = config.row_cache
+        if row_cache is None or ReadConsistency(read_consistency) == ReadConsistency.STRONG:
+            return self.conn.send_request(http_methods.POST,
+                    path=uri,
+                    body=json_body,
+                    params={b'query': b''},
+                    config=config)
+
+        key = row_cache.make_key(self.database_name, self.table_name, primary_key,
+                partition_key, projections, retrieve_vector)
+        hit, response, error = row_cache.get(key)
+        if hit:
+            if error is not None:
+                raise error
+            return response
+        generation = row_cache.generation(key)
+        try:
+            response = self.conn.send_request(http_methods.POST,
+                    path=uri,
+                    body=json_body,
+                    params={b'query': b''},
+                    config=config)
+        except Exception as e:
+            if isinstance(e, ServerError) and e.code == ServerErrCode.ROW_KEY_NOT_FOUND:
+                row_cache.put(key, generation, error=e)
+            else:
+                row_cache.release(generation)
+            raise
+        row_cache.put(key, generation, response=response)
+        return response
 
     def search(self, anns, partition_key=None, projections=None,
             retrieve_vector=False, read_consistency=ReadConsistency.EVENTUAL,
@@ -271,6 +478,158 @@ class Table:
                 params={b'search': b''},
                 config=config)
 
+    def search_many(self, anns_list, partition_key=None, projections=None,
+            retrieve_vector=False, read_consistency=ReadConsistency.EVENTUAL,
+            config=None, concurrency=None):
+        """
+        run independent searches concurrently on the executor shared by the client
+        Args:
+            anns_list(List[AnnSearch]): searches to run
+            concurrency(Optional[int]): maximum searches in flight, the size of the
+                shared executor by default
+        Returns:
+            FutureList: one future per search, in input order
+        """
+        if not self.conn:
+            raise ClientError('conn is closed')
+
+        def search(anns):
+            return self.search(anns, partition_key=partition_key, projections=projections,
+                    retrieve_vector=retrieve_vector, read_consistency=read_consistency,
+                    config=config)
+        return _fan_out(self.conn.executor, search, anns_list, concurrency)
+
+    def query_many(self, primary_keys, partition_keys=None, projections=None,
+            retrieve_vector=False, read_consistency=ReadConsistency.EVENTUAL,
+            config=None, concurrency=None):
+        """
+        query rows by primary key concurrently on the executor shared by the client
+        Args:
+            primary_keys(List[dict]): primary keys of the rows
+            partition_keys(Optional[List[dict]]): partition keys aligned with primary_keys
+            concurrency(Optional[int]): maximum queries in flight, the size of the
+                shared executor by default
+        Returns:
+            FutureList: one future per primary key, in input order
+        """
+        if not self.conn:
+            raise ClientError('conn is closed')
+        if partition_keys is not None and len(partition_keys) != len(primary_keys):
+            raise ValueError('partition_keys should be aligned with primary_keys')
+
+        def query(i):
+            return self.query(primary_keys[i],
+                    partition_key=partition_keys[i] if partition_keys is not None else None,
+                    projections=projections, retrieve_vector=retrieve_vector,
+                    read_consistency=read_consistency, config=config)
+        return _fan_out(self.conn.executor, query, range(len(primary_keys)), concurrency)
+
+    def batch_query(self, keys, partition_keys=None, projections=None,
+            retrieve_vector=False, read_consistency=ReadConsistency.EVENTUAL,
+            config=None, concurrency=None):
+        """
+        query many rows by primary key.
+
+        Repeated keys are queried once. Keys are dispatched grouped by partition
+        key value and queried with bounded parallelism on the executor shared by
+        the client, as the server has no multi-row query.
+        Args:
+            keys(List[dict]): primary keys of the rows
+            partition_keys(Optional[List[dict]]): partition keys aligned with keys
+            concurrency(Optional[int]): maximum queries in flight, the size of the
+                shared executor by default
+        Returns:
+            List[Optional[dict]]: the row of each key in input order, None for keys
+                not found
+        Raises:
+            ServerError: the first error other than ROW_KEY_NOT_FOUND
+        """
+        if not self.conn:
+            raise ClientError('conn is closed')
+        if partition_keys is not None and len(partition_keys) != len(keys):
+            raise ValueError('partition_keys should be aligned with keys')
+
+        unique_keys = []
+        slots = {}
+        order = []
+        for i, key in enumerate(keys):
+            partition_key = partition_keys[i] if partition_keys is not None else None
+            ident = orjson.dumps([key, partition_key], option=orjson.OPT_SORT_KEYS)
+            slot = slots.get(ident)
+            if slot is None:
+                slot = slots[ident] = len(unique_keys)
+                unique_keys.append((key, partition_key))
+            order.append(slot)
+
+        partition_field = self._partition_key_field()
+        groups = collections.OrderedDict()
+        for slot, (key, partition_key) in enumerate(unique_keys):
+            if partition_key is not None:
+                value = partition_key
+            elif partition_field is not None and isinstance(key, dict):
+                value = key.get(partition_field)
+            else:
+                value = None
+            groups.setdefault(orjson.dumps(value, option=orjson.OPT_SORT_KEYS), []).append(slot)
+        dispatch = [slot for group in groups.values() for slot in group]
+
+        def query(slot):
+            key, partition_key = unique_keys[slot]
+            return self.query(key, partition_key=partition_key, projections=projections,
+                    retrieve_vector=retrieve_vector, read_consistency=read_consistency,
+                    config=config)
+        futures = _fan_out(self.conn.executor, query, dispatch, concurrency)
+
+        rows = [None] * len(unique_keys)
+        for slot, future in zip(dispatch, futures):
+            try:
+                rows[slot] = future.result().row
+            except ServerError as e:
+                if e.code != ServerErrCode.ROW_KEY_NOT_FOUND:
+                    futures.cancel()
+                    raise
+        return [rows[slot] for slot in order]
+
+    def _primary_key_fields(self):
+        """names of the primary key fields in the schema, if known"""
+        if self.schema is None:
+            return None
+        names = [field.field_name for field in self.schema.fields if field.primary_key]
+        return names or None
+
+    def _invalidate_key(self, config, primary_key):
+        """drop a written row from the row cache, or the whole table when unknown"""
+        row_cache = config.row_cache
+        if row_cache is None:
+            return
+        if primary_key is None:
+            row_cache.invalidate_table(self.database_name, self.table_name)
+        else:
+            row_cache.invalidate(self.database_name, self.table_name, primary_key)
+
+    def _invalidate_rows(self, config, rows):
+        """drop written rows from the row cache, or the whole table when unknown"""
+        row_cache = config.row_cache
+        if row_cache is None:
+            return
+        names = self._primary_key_fields()
+        if rows is None or names is None:
+            row_cache.invalidate_table(self.database_name, self.table_name)
+            return
+        for row in rows:
+            if all(name in row for name in names):
+                row_cache.invalidate(self.database_name, self.table_name,
+                        {name: row[name] for name in names})
+
+    def _partition_key_field(self):
+        """name of the partition key field in the schema, if known"""
+        if self.schema is None:
+            return None
+        for field in self.schema.fields:
+            if field.partition_key:
+                return field.field_name
+        return None
+
     def delete(self, primary_key=None, partition_key=None, filter=None, config=None):
         """
         delete row
@@ -299,11 +658,37 @@ class Table:
         config = self._merge_config(config)
         uri = utils.append_uri(client.URL_PREFIX, client.URL_VERSION, 'row')
 
-        return self.conn.send_request(http_methods.POST,
-                path=uri,
-                body=json_body,
-                params={b'delete': b''},
-                config=config)
+        try:
+            return self.conn.send_request(http_methods.POST,
+                    path=uri,
+                    body=json_body,
+                    params={b'delete': b''},
+                    config=config)
+        finally:
+            self._invalidate_key(config, primary_key if filter is None else None)
+
+    def delete_by_filter(self, filter, batch_size=1000, concurrency=None,
+            max_rows_per_second=None, progress=None, marker=None, config=None):
+        """
+        delete the rows matching a filter in throttled key range batches
+        instead of one request, see pymochow.bulk.purge.FilterDeleter
+        Args:
+            filter(str): filter of the rows to delete
+            batch_size(int): rows per select of the primary keys and per delete
+            concurrency(Optional[int]): batch deletes in flight
+            max_rows_per_second(Optional[float]): rate cap of deleted rows
+            progress(Optional[Callable[[DeleteProgress], None]]): called after every page
+            marker(Optional[dict]): marker to resume from, from a DeleteProgress
+            config(Optional[Configuration]): client configuration
+        Returns:
+            DeleteProgress: rows scanned, deleted and failed
+        """
+        if not self.conn:
+            raise ClientError('conn is closed')
+        from pymochow.bulk.purge import FilterDeleter
+        return FilterDeleter(self, filter, batch_size=batch_size, concurrency=concurrency,
+                max_rows_per_second=max_rows_per_second, progress=progress,
+                config=config).run(marker)
 
     def update(self, primary_key=None, partition_key=None, update_fields=None, config=None):
         """
@@ -329,11 +714,38 @@ class Table:
         config = self._merge_config(config)
         uri = utils.append_uri(client.URL_PREFIX, client.URL_VERSION, 'row')
 
-        return self.conn.send_request(http_methods.POST,
-                path=uri,
-                body=json_body,
-                params={b'update': b''},
-                config=config)
+        try:
+            return self.conn.send_request(http_methods.POST,
+                    path=uri,
+                    body=json_body,
+                    params={b'update': b''},
+                    config=config)
+        finally:
+            self._invalidate_key(config, primary_key)
+
+    def bulk_update(self, updates, concurrency=None, max_rows_per_second=None,
+            adaptive=None, fold_window=1000, progress=None, config=None):
+        """
+        apply many updates concurrently, see pymochow.bulk.update.BulkUpdater
+        Args:
+            updates(Iterable[Tuple[dict, Optional[dict], dict]]): primary key,
+                partition key and update fields of each update
+            concurrency(Optional[int]): updates in flight
+            max_rows_per_second(Optional[float]): rate cap of updates
+            adaptive(Optional[AimdController]): pace concurrency at runtime
+            fold_window(int): pending updates folded by key, 0 not to fold
+            progress(Optional[Callable[[UpdateProgress], None]]): called every
+                1000 finished updates
+            config(Optional[Configuration]): client configuration
+        Returns:
+            UpdateProgress: rows updated, folded and failed, and throughput
+        """
+        if not self.conn:
+            raise ClientError('conn is closed')
+        from pymochow.bulk.update import BulkUpdater
+        return BulkUpdater(self, concurrency=concurrency,
+                max_rows_per_second=max_rows_per_second, adaptive=adaptive,
+                fold_window=fold_window, progress=progress, config=config).run(updates)
 
     def select(self, filter=None, marker=None, projections=None, read_consistency=ReadConsistency.EVENTUAL, limit=10,
             config=None):
@@ -417,6 +829,42 @@ class Table:
                 params={b'addField': b''},
                 config=config)
 
+    def alias(self, alias, config=None):
+        """
+        point an alias at the table
+        Args:
+            alias(str): alias name
+            config(Optional[Configuration]): client configuration
+        """
+        return self._alias_request(b'alias', alias, config)
+
+    def unalias(self, alias, config=None):
+        """
+        remove an alias of the table
+        Args:
+            alias(str): alias name
+            config(Optional[Configuration]): client configuration
+        """
+        return self._alias_request(b'unalias', alias, config)
+
+    def _alias_request(self, op, alias, config):
+        if not self.conn:
+            raise ClientError('conn is closed')
+
+        if not alias:
+            raise ClientError('alias param not found')
+
+        config = self._merge_config(config)
+        uri = utils.append_uri(client.URL_PREFIX, client.URL_VERSION, 'table')
+
+        return self.conn.send_request(http_methods.POST,
+                path=uri,
+                body=orjson.dumps({"database": self.database_name,
+                    "table": self.table_name,
+                    "alias": alias}),
+                params={op: b''},
+                config=config)
+
     def create_indexes(self, indexes, config=None):
         """
         create indexes
@@ -564,6 +1012,36 @@ class Table:
             raise ClientError("not supported index type:%s" % (index["indexType"]))
 
 
+    def wait_for_index(self, index_name, timeout=None, config=None):
+        """
+        wait for an index to reach IndexState.NORMAL, polling with growing
+        intervals, see pymochow.index.waiter.IndexWaiter
+        Args:
+            index_name(str): the index name
+            timeout(Optional[float]): seconds before failing with ClientError
+            config(Optional[Configuration]): client configuration
+        Returns:
+            VectorIndex: the index description
+        """
+        return self.wait_for_index_async(index_name, timeout, config).result()
+
+    def wait_for_index_async(self, index_name, timeout=None, config=None):
+        """
+        wait for an index to reach IndexState.NORMAL without blocking, all the
+        indexes waited for being polled from one thread. From asyncio, await
+        asyncio.wrap_future(table.wait_for_index_async(index_name)).
+        Args:
+            index_name(str): the index name
+            timeout(Optional[float]): seconds before failing with ClientError
+            config(Optional[Configuration]): client configuration
+        Returns:
+            Future: of the index description
+        """
+        if not self.conn:
+            raise ClientError('conn is closed')
+        from pymochow.index.waiter import default_waiter
+        return default_waiter().wait_async(self, index_name, timeout=timeout, config=config)
+
     def stats(self, config=None):
         """show table stats"""
         if not self.conn:
@@ -583,6 +1061,79 @@ class Table:
                 params={b'stats': b''},
                 config=config)
 
+class FutureList(list):
+    """
+    futures of a fan-out operation, in the order of its inputs
+    """
+
+    def results(self, timeout=None):
+        """
+        wait for all futures
+        Returns:
+            List: the result of each future, or the exception it raised
+        """
+        res = []
+        for future in self:
+            try:
+                res.append(future.result(timeout=timeout))
+            except Exception as e:
+                res.append(e)
+        return res
+
+    def cancel(self):
+        """
+        cancel the futures not started yet
+        Returns:
+            int: number of futures cancelled
+        """
+        return sum(1 for future in self if future.cancel())
+
+
+def _fan_out(executor, fn, items, concurrency=None):
+    """
+    apply fn to every item on executor with at most concurrency calls in flight.
+    The returned futures stay pending, and so cancellable, until their call is
+    submitted to the executor.
+    """
+    if concurrency is None:
+        concurrency = executor._max_workers
+    if concurrency <= 0:
+        raise ValueError('concurrency should be a positive integer')
+    items = list(items)
+    futures = FutureList(Future() for _ in items)
+    pending = collections.deque(zip(items, futures))
+
+    def transfer(inner, future):
+        # the outer future is running, so it can no longer be cancelled
+        if inner.cancelled():
+            future.set_exception(CancelledError())
+        elif inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
+        launch()
+
+    def launch():
+        while True:
+            try:
+                item, future = pending.popleft()
+            except IndexError:
+                return
+            if future.set_running_or_notify_cancel():
+                try:
+                    inner = executor.submit(fn, item)
+                except Exception as e:
+                    # e.g. the executor was shut down by HTTPClient.close
+                    future.set_exception(e)
+                    continue
+                inner.add_done_callback(lambda f, future=future: transfer(f, future))
+                return
+
+    for _ in range(min(concurrency, len(items))):
+        launch()
+    return futures
+
+
 class Row:
     """
     row, the object for document insert, query and search, the parameter depends on
@@ -27,11 +27,18 @@ setup(
         'orjson',
         'future'
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+        'parquet': ['pyarrow'],
+    },
     python_requires='>=3.7',
     packages=[
         'pymochow',
         'pymochow.auth',
+        'pymochow.bulk',
+        'pymochow.cache',
         'pymochow.http',
+        'pymochow.index',
         'pymochow.retry',
         'pymochow.client',
         'pymochow.model'